@@ -2,11 +2,11 @@
 Utility functions for CBC scraper - comparison, sorting, and debugging.
 """
 
-import json
 import logging
 import re
 from deepdiff import DeepDiff
 from schema import Code
+from fast_json import load_json
 
 logger = logging.getLogger(__name__)
 
@@ -60,9 +60,8 @@ def sort_code_data(code: Code) -> Code:
 
 def compare_json_files(file1: str, file2: str) -> dict:
     """Compare two JSON files and return differences."""
-    with open(file1, "r") as f1, open(file2, "r") as f2:
-        data1 = json.load(f1)
-        data2 = json.load(f2)
+    data1 = load_json(file1)
+    data2 = load_json(file2)
     
     diff = DeepDiff(data1, data2, ignore_order=False, verbose_level=2)
     return diff
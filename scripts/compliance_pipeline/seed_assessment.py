@@ -66,8 +66,27 @@ def seed_assessment(assessment_id: str, env: str = 'prod'):
     print(f"[SEED] Found {len(sections)} sections to seed")
 
     # 3. Check which sections already have checks
-    existing_response = supabase.table('checks').select('section_id').eq('assessment_id', assessment_id).execute()
-    existing_ids = {c['section_id'] for c in (existing_response.data or [])}
+    # Paginate: an unbounded select is capped at 1000 rows, which would re-seed existing checks
+    existing_ids = set()
+    offset = 0
+    while True:
+        existing_response = supabase.table('checks').select('section_id')\
+            .eq('assessment_id', assessment_id)\
+            .order('id')\
+            .range(offset, offset + batch_size - 1)\
+            .execute()
+
+        batch = existing_response.data
+        if not batch:
+            break
+
+        existing_ids.update(c['section_id'] for c in batch)
+
+        if len(batch) < batch_size:
+            break
+
+        offset += batch_size
+
     sections_to_add = [s for s in sections if s['id'] not in existing_ids]
 
     print(f"[SEED] {len(existing_ids)} checks already exist")
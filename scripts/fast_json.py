@@ -0,0 +1,42 @@
+"""
+Fast JSON helpers shared by the scripts in this directory (scrapers, loaders
+and LLM pipelines).
+
+Uses orjson when it is installed and falls back to the stdlib json module,
+producing the same UTF-8 output either way.
+"""
+
+import json
+from pathlib import Path
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # Fall back to the stdlib encoder
+    orjson = None
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    """Parse a JSON document from str or bytes."""
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def dumps(data: Any) -> str:
+    """Serialize data to compact single-line JSON text."""
+    return orjson.dumps(data).decode() if orjson else json.dumps(data, ensure_ascii=False)
+
+
+def load_json(path: Union[str, Path]) -> Any:
+    """Read and parse a JSON file."""
+    data = Path(path).read_bytes()
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def dump_json(data: Any, path: Union[str, Path], sort_keys: bool = False) -> None:
+    """Write data to a JSON file with 2-space indentation."""
+    if orjson:
+        option = orjson.OPT_INDENT_2 | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        Path(path).write_bytes(orjson.dumps(data, option=option))
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, sort_keys=sort_keys, ensure_ascii=False)
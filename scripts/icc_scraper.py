@@ -15,10 +15,11 @@ import logging
 import json
 from pathlib import Path
 from utils import generate_section_url, get_icc_part_number
-from s3 import RawICCS3, BUCKET_NAME, upload_image_to_s3
+from s3 import RawICCS3, BUCKET_NAME, upload_images_bulk
 from schema import Code, Section, Subsection, TableBlock
 from utils import extract_table_data, extract_figure_url
 from cbc_utils import sort_code_data, compare_json_files, print_comparison_summary
+from fast_json import dump_json
 
 # State-specific configuration
 STATE_CONFIG = {
@@ -234,6 +235,7 @@ def extract_tables_and_figures(soup: BeautifulSoup, extract_images: bool, year:
     """Extract tables and figures from HTML."""
     tables = []
     figures = []
+    pending_uploads = []
     part = get_icc_part_number(year)
     code_prefix = f"{state}BC"
     base_url = f"https://codes.iccsafe.org/content/{code_prefix}{year}{part}/"
@@ -272,18 +274,25 @@ def extract_tables_and_figures(soup: BeautifulSoup, extract_images: bool, year:
         elif "figure" in fig_class:
             img_url = extract_figure_url(fig_elem, base_url)
             if img_url:
-                s3_url = ""
-                if extract_images:
-                    s3_key = f"cleaned/ICC/{state}/{year}/figures/{fig_number}.jpg"
-                    s3_url = upload_image_to_s3(img_url, s3_key)
-                
-                figures.append({
+                figure = {
                     "number": fig_number,
                     "caption": caption,
-                    "url": s3_url if s3_url else img_url,
-                    "uploaded": bool(s3_url),
+                    "url": img_url,
+                    "uploaded": False,
                     "type": "figure",
-                })
+                }
+                figures.append(figure)
+                if extract_images:
+                    s3_key = f"cleaned/ICC/{state}/{year}/figures/{fig_number}.jpg"
+                    pending_uploads.append((figure, img_url, s3_key))
+    
+    # Upload all figure images concurrently rather than one round trip at a time
+    if pending_uploads:
+        s3_urls = upload_images_bulk([(img_url, s3_key) for _, img_url, s3_key in pending_uploads])
+        for (figure, _, _), s3_url in zip(pending_uploads, s3_urls):
+            if s3_url:
+                figure["url"] = s3_url
+                figure["uploaded"] = True
     
     logger.info(f"Extracted {len(tables)} tables and {len(figures)} figures")
     return tables, figures
@@ -632,8 +641,7 @@ def main(args):
     output_filename = f"{state.lower()}bc_{args.version}_{chapters_suffix}.json"
     new_output_filename = f"{state.lower()}bc_{args.version}_{chapters_suffix}_new.json" if args.compare else output_filename
     
-    with open(new_output_filename, "w") as f:
-        json.dump(code.model_dump(), f, indent=2, sort_keys=True)
+    dump_json(code.model_dump(), new_output_filename, sort_keys=True)
     
     logger.info(f"Output saved to {new_output_filename}")
     
@@ -60,12 +60,17 @@ Usage:
 """
 
 import argparse
-import json
+import asyncio
 import os
 import logging
 import re
-from typing import Dict, Any, List, Optional
-from supabase import create_client, Client
+import sys
+from typing import Callable, Dict, Any, List, Optional
+from supabase import create_async_client, AsyncClient
+
+# fast_json lives one level up in scripts/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fast_json import loads
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s"
@@ -76,15 +81,26 @@ ENV = os.getenv("ENV", "development")
 REGION = "us-east-2" if ENV == "prod" else "us-east-1"
 BUCKET_NAME = "set4-codes"
 
+# Max in-flight PostgREST requests when upserting batches concurrently
+MAX_CONCURRENT_REQUESTS = 16
+
+WHITESPACE_RE = re.compile(r"\s+")
+
 
-def section_key_func(
-    provider: str, version: str, jurisdiction: Optional[str], source_id: str, number: str
-) -> str:
-    """Generate unique key for section/subsection."""
+def make_section_key_func(
+    provider: str, version: str, jurisdiction: Optional[str], source_id: str
+) -> Callable[[str], str]:
+    """
+    Build the section/subsection key generator for one code.
+
+    The code-level parts are fixed for a whole file, so the prefix is formatted
+    once and each call is a single concatenation with the section number.
+    """
     if jurisdiction:
-        return f"{provider}:{source_id}:{version}:{jurisdiction}:{number}"
+        prefix = f"{provider}:{source_id}:{version}:{jurisdiction}:"
     else:
-        return f"{provider}:{source_id}:{version}:{number}"
+        prefix = f"{provider}:{source_id}:{version}:"
+    return prefix.__add__
 
 
 def sha256_of(*parts: str) -> str:
@@ -115,23 +131,48 @@ def load_data_from_path(file_path: str) -> Dict[str, Any]:
         logger.info(f"Downloading s3://{bucket}/{key}")
         s3 = boto3.client("s3", region_name=REGION)
         response = s3.get_object(Bucket=bucket, Key=key)
-        content = response["Body"].read().decode("utf-8")
-        data = json.loads(content)
+        data = loads(response["Body"].read())
         logger.info("Successfully downloaded Code data from S3")
         return data
     else:
         logger.info(f"Loading data from local file: {file_path}")
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        with open(file_path, "rb") as f:
+            data = loads(f.read())
         logger.info(f"Successfully loaded Code data from {file_path}")
         return data
 
 
+def group_by_depth(items: List[dict]) -> List[List[dict]]:
+    """
+    Group items into waves so every parent is upserted before its children.
+
+    parent_key is a foreign key to sections.key, so batches upserted concurrently
+    must never contain a child whose parent is still in flight.
+    """
+    by_key = {item["key"]: item for item in items}
+    depths: Dict[str, int] = {}
+
+    def depth_of(item: dict) -> int:
+        key = item["key"]
+        if key not in depths:
+            parent = by_key.get(item.get("parent_key"))
+            depths[key] = depth_of(parent) + 1 if parent else 0
+        return depths[key]
+
+    waves: List[List[dict]] = []
+    for item in items:
+        depth = depth_of(item)
+        while len(waves) <= depth:
+            waves.append([])
+        waves[depth].append(item)
+    return waves
+
+
 def clean_text(text: str) -> str:
     """Clean and normalize text."""
     if not text:
         return text
-    return re.sub(r"\s+", " ", text).strip()
+    return WHITESPACE_RE.sub(" ", text).strip()
 
 
 def determine_code_type(code_data: Dict[str, Any]) -> str:
@@ -160,8 +201,8 @@ def determine_code_type(code_data: Dict[str, Any]) -> str:
     return "building"
 
 
-def upload_items_to_supabase(
-    supabase: Client,
+async def upload_items_to_supabase(
+    supabase: AsyncClient,
     all_items: List[dict],
     code_data: Dict[str, Any],
     code_id: str,
@@ -176,95 +217,143 @@ def upload_items_to_supabase(
     # Track items with amendments for later resolution
     amendment_mappings = []  # List of (section_key, amends_section_number)
 
-    # Batch upsert sections
-    batch_size = 100
-    for i in range(0, total_items, batch_size):
-        batch = all_items[i : i + batch_size]
-        logger.info(
-            f"Progress: {i}/{total_items} items upserted ({(i/total_items)*100:.1f}%)"
-        )
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    upserted = 0
 
-        # Prepare batch data for upsert
-        batch_data = []
-        for item in batch:
-            record = {
-                "key": item["key"],
-                "code_id": code_id,
-                "parent_key": item.get("parent_key"),
-                "number": item["number"],
-                "title": item["title"],
-                "text": item["text"],
-                "item_type": item["item_type"],
-                "code_type": code_type,
-                "paragraphs": item.get("paragraphs", []),
-                "tables": item.get("tables", []),
-                "figures": item.get("figures", []),
-                "source_url": item.get("source_url", ""),
-                "source_page": item.get("source_page"),
-                "hash": sha256_of(
-                    item["provider"],
-                    str(item["version"]),
-                    item["jurisdiction"] or "",
-                    item["source_id"],
-                    item["number"],
-                    item["title"],
-                    item["text"] or "",
-                ),
-            }
+    async def upsert_batch(batch_data: List[dict]):
+        nonlocal upserted
+        async with semaphore:
+            # Upsert batch (on_conflict='key' means update if exists, insert if not)
+            try:
+                await supabase.table("sections").upsert(batch_data, on_conflict="key").execute()
+            except Exception as e:
+                logger.error(f"Error upserting batch: {e}")
+                # Try individual upserts for this batch to identify problematic records
+                for record in batch_data:
+                    try:
+                        await supabase.table("sections").upsert(record, on_conflict="key").execute()
+                    except Exception as record_error:
+                        logger.error(f"Failed to upsert record {record['key']}: {record_error}")
+            upserted += len(batch_data)
+            logger.info(
+                f"Progress: {upserted}/{total_items} items upserted ({(upserted/total_items)*100:.1f}%)"
+            )
 
-            # Add optional fields only if they exist in the item
-            optional_fields = ["chapter", "chapter_id"]
+    # Fields shared by every record in this file; copied per row instead of rebuilt
+    base_record = {"code_id": code_id, "code_type": code_type}
 
-            for field in optional_fields:
-                if field in item and item[field] is not None:
-                    record[field] = item[field]
+    # Batch upsert sections, one wave per hierarchy level so parents land first
+    batch_size = 100
+    for wave in group_by_depth(all_items):
+        wave_batches = []
+        for i in range(0, len(wave), batch_size):
+            batch = wave[i : i + batch_size]
+
+            # Prepare batch data for upsert
+            batch_data = []
+            for item in batch:
+                record = base_record.copy()
+                record.update(
+                    key=item["key"],
+                    parent_key=item.get("parent_key"),
+                    number=item["number"],
+                    title=item["title"],
+                    text=item["text"],
+                    item_type=item["item_type"],
+                    paragraphs=item.get("paragraphs", ()),
+                    tables=item.get("tables", ()),
+                    figures=item.get("figures", ()),
+                    source_url=item.get("source_url", ""),
+                    source_page=item.get("source_page"),
+                    hash=sha256_of(
+                        item["provider"],
+                        str(item["version"]),
+                        item["jurisdiction"] or "",
+                        item["source_id"],
+                        item["number"],
+                        item["title"],
+                        item["text"] or "",
+                    ),
+                )
 
-            # Track amendment relationships for later resolution
-            if "amends_section" in item and item["amends_section"]:
-                amendment_mappings.append((item["key"], item["amends_section"]))
+                # Add optional fields only if they exist in the item
+                if item.get("chapter") is not None:
+                    record["chapter"] = item["chapter"]
+                if item.get("chapter_id") is not None:
+                    record["chapter_id"] = item["chapter_id"]
 
-            batch_data.append(record)
+                # Track amendment relationships for later resolution
+                if "amends_section" in item and item["amends_section"]:
+                    amendment_mappings.append((item["key"], item["amends_section"]))
 
-        # Upsert batch (on_conflict='key' means update if exists, insert if not)
-        try:
-            supabase.table("sections").upsert(batch_data, on_conflict="key").execute()
-        except Exception as e:
-            logger.error(f"Error upserting batch: {e}")
-            # Try individual upserts for this batch to identify problematic records
-            for record in batch_data:
-                try:
-                    supabase.table("sections").upsert(record, on_conflict="key").execute()
-                except Exception as record_error:
-                    logger.error(f"Failed to upsert record {record['key']}: {record_error}")
+                batch_data.append(record)
+
+            wave_batches.append(batch_data)
+
+        await asyncio.gather(*[upsert_batch(batch_data) for batch_data in wave_batches])
 
     logger.info("All items upserted successfully")
 
     # Resolve amendment relationships
     if amendment_mappings:
         logger.info(f"Resolving {len(amendment_mappings)} amendment relationships...")
-        for section_key, amends_section_number in amendment_mappings:
-            try:
-                # Find the section being amended by number (from CBC or other base code)
-                # Look for CBC sections with matching number
-                result = supabase.table("sections").select("id").eq("number", amends_section_number).execute()
 
-                if result.data and len(result.data) > 0:
-                    # If multiple matches, prefer CBC sections (code_id starting with ICC)
-                    amended_section_id = None
+        # Find the sections being amended by number (from CBC or other base code)
+        # with one IN query per chunk instead of one SELECT per amendment
+        amended_numbers = list({number for _, number in amendment_mappings})
+        number_to_id = {}
+        lookup_batch_size = 100
+        page_size = 500
+        for i in range(0, len(amended_numbers), lookup_batch_size):
+            batch_numbers = amended_numbers[i : i + lookup_batch_size]
+            offset = 0
+            try:
+                # A number exists in several codes/editions, so one IN query can exceed
+                # PostgREST's max-rows; page until an empty page rather than trusting a short one
+                while True:
+                    result = await (
+                        supabase.table("sections")
+                        .select("id,number")
+                        .in_("number", batch_numbers)
+                        .neq("code_id", code_id)
+                        .order("created_at")
+                        .order("id")
+                        .range(offset, offset + page_size - 1)
+                        .execute()
+                    )
+                    if not result.data:
+                        break
                     for row in result.data:
-                        amended_section_id = row["id"]
-                        break  # Use first match for now
+                        # If multiple matches, use the earliest-loaded section; base codes are
+                        # loaded before the codes that amend them. id (a random UUID) only breaks
+                        # ties between rows from the same upsert so paging sees a stable order.
+                        number_to_id.setdefault(row["number"], row["id"])
+                    # Advance by what came back so a server cap below page_size can't skip rows
+                    offset += len(result.data)
+            except Exception as e:
+                logger.error(f"Error looking up amended sections: {e}")
 
+        async def link_amendment(section_key: str, amends_section_number: str):
+            amended_section_id = number_to_id.get(amends_section_number)
+            if not amended_section_id:
+                logger.warning(f"  ⚠ Could not find base section for number '{amends_section_number}' (amendment: {section_key})")
+                return
+
+            async with semaphore:
+                try:
                     # Update the amendment section with the reference
-                    supabase.table("sections").update({
+                    await supabase.table("sections").update({
                         "amends_section_id": amended_section_id
                     }).eq("key", section_key).execute()
 
                     logger.info(f"  ✓ Linked {section_key} → amends section ID {amended_section_id}")
-                else:
-                    logger.warning(f"  ⚠ Could not find base section for number '{amends_section_number}' (amendment: {section_key})")
-            except Exception as e:
-                logger.error(f"  ✗ Error resolving amendment for {section_key}: {e}")
+                except Exception as e:
+                    logger.error(f"  ✗ Error resolving amendment for {section_key}: {e}")
+
+        await asyncio.gather(*[
+            link_amendment(section_key, amends_section_number)
+            for section_key, amends_section_number in amendment_mappings
+        ])
 
         logger.info("Amendment relationships resolved")
 
@@ -315,15 +404,20 @@ def upload_items_to_supabase(
         lookup_batch_size = 500
         ref_keys_list = list(all_ref_keys)
 
-        for i in range(0, len(ref_keys_list), lookup_batch_size):
-            batch_keys = ref_keys_list[i : i + lookup_batch_size]
-            try:
-                result = supabase.table("sections").select("key,id").in_("key", batch_keys).execute()
-                for row in result.data:
-                    key_to_id_map[row["key"]] = row["id"]
-                logger.info(f"  Looked up {len(result.data)} section IDs ({i + len(batch_keys)}/{len(ref_keys_list)})")
-            except Exception as e:
-                logger.error(f"Error looking up section IDs: {e}")
+        async def lookup_batch(batch_keys: List[str]):
+            async with semaphore:
+                try:
+                    result = await supabase.table("sections").select("key,id").in_("key", batch_keys).execute()
+                    for row in result.data:
+                        key_to_id_map[row["key"]] = row["id"]
+                    logger.info(f"  Looked up {len(result.data)} section IDs ({len(key_to_id_map)}/{len(ref_keys_list)})")
+                except Exception as e:
+                    logger.error(f"Error looking up section IDs: {e}")
+
+        await asyncio.gather(*[
+            lookup_batch(ref_keys_list[i : i + lookup_batch_size])
+            for i in range(0, len(ref_keys_list), lookup_batch_size)
+        ])
 
         # Add section IDs to reference records
         references_with_ids = []
@@ -355,19 +449,28 @@ def upload_items_to_supabase(
 
         # Batch upsert references with IDs
         logger.info(f"Upserting {len(references_with_ids)} cross-references with section IDs...")
-        batch_size = 100
-        for i in range(0, len(references_with_ids), batch_size):
-            batch = references_with_ids[i : i + batch_size]
-            try:
-                # Upsert to avoid duplicate errors on re-upload
-                supabase.table("section_references").upsert(batch).execute()
-            except Exception as e:
-                logger.error(f"Error upserting reference batch: {e}")
+        async def upsert_reference_batch(batch: List[dict]):
+            async with semaphore:
+                try:
+                    # Skip edges that already exist (unique_section_reference) on re-upload
+                    await supabase.table("section_references").upsert(
+                        batch,
+                        on_conflict="source_section_key,target_section_key",
+                        ignore_duplicates=True,
+                    ).execute()
+                except Exception as e:
+                    logger.error(f"Error upserting reference batch: {e}")
+
+        batch_size = 1000
+        await asyncio.gather(*[
+            upsert_reference_batch(references_with_ids[i : i + batch_size])
+            for i in range(0, len(references_with_ids), batch_size)
+        ])
 
     logger.info(f"Upserted {len(references_with_ids) if references_to_insert else 0} cross-references")
 
 
-def upload_unified_code(code_data: Dict[str, Any], supabase: Client):
+async def upload_unified_code(code_data: Dict[str, Any], supabase: AsyncClient):
     """Upload unified Code data to Supabase, only upserting the specified sections."""
     logger.info("Starting upload to Supabase (Upsert only)")
 
@@ -398,7 +501,7 @@ def upload_unified_code(code_data: Dict[str, Any], supabase: Client):
         logger.info("Ensuring code record exists...")
         # Try to insert, but if it already exists, just continue
         try:
-            supabase.table("codes").insert(
+            await supabase.table("codes").insert(
                 {
                     "id": code_id,
                     "year": version,
@@ -425,7 +528,7 @@ def upload_unified_code(code_data: Dict[str, Any], supabase: Client):
         for chapter_num in chapters_included:
             try:
                 # Try to get existing chapter
-                result = supabase.table("chapters").select("id").eq("code_id", code_id).eq("number", chapter_num).execute()
+                result = await supabase.table("chapters").select("id").eq("code_id", code_id).eq("number", chapter_num).execute()
                 if result.data:
                     chapter_id = result.data[0]["id"]
                     logger.info(f"  ✓ Chapter {chapter_num} exists: {chapter_id}")
@@ -437,7 +540,7 @@ def upload_unified_code(code_data: Dict[str, Any], supabase: Client):
                         "name": f"Chapter {chapter_num}",
                         "url": f"https://codes.iccsafe.org/content/CABC{version}P4/chapter-{chapter_num}"
                     }
-                    result = supabase.table("chapters").insert(chapter_data).execute()
+                    result = await supabase.table("chapters").insert(chapter_data).execute()
                     chapter_id = result.data[0]["id"]
                     logger.info(f"  ✓ Chapter {chapter_num} created: {chapter_id}")
 
@@ -449,14 +552,14 @@ def upload_unified_code(code_data: Dict[str, Any], supabase: Client):
     sections = code_data.get("sections", [])
     logger.info(f"Processing {len(sections)} sections...")
 
+    section_key_func = make_section_key_func(provider, version, jurisdiction, source_id)
+
     for section in sections:
         section_number = section["number"]
         section_title = section["title"]
         section_text = section.get("text", "")
 
-        section_key = section_key_func(
-            provider, version, jurisdiction, source_id, section_number
-        )
+        section_key = section_key_func(section_number)
 
         chapter_num = section.get("chapter")
         # Normalize chapter_num to lowercase for lookup (case-insensitive)
@@ -473,8 +576,8 @@ def upload_unified_code(code_data: Dict[str, Any], supabase: Client):
             "text": clean_text(section_text),
             "item_type": "section",
             "parent_key": None,
-            "paragraphs": [],
-            "refers_to": [],  # For cross-references only
+            "paragraphs": (),
+            "refers_to": (),  # For cross-references only
             "tables": section.get("tables", []),
             "figures": section.get("figures", []),
             "source_url": section.get("source_url", ""),
@@ -497,9 +600,7 @@ def upload_unified_code(code_data: Dict[str, Any], supabase: Client):
                 subsection_text += " " + " ".join(paragraphs)
             subsection_text = clean_text(subsection_text)
 
-            subsection_key = section_key_func(
-                provider, version, jurisdiction, source_id, subsection_number
-            )
+            subsection_key = section_key_func(subsection_number)
 
             # Determine parent key based on subsection depth
             # For multi-level subsections like 11B-216.5.3.1, parent should be 11B-216.5.3
@@ -509,9 +610,7 @@ def upload_unified_code(code_data: Dict[str, Any], supabase: Client):
                 # Multi-level subsection (e.g., 11B-216.5.3.1)
                 # Parent is everything except the last part
                 parent_number = '.'.join(parts[:-1])
-                parent_key = section_key_func(
-                    provider, version, jurisdiction, source_id, parent_number
-                )
+                parent_key = section_key_func(parent_number)
             else:
                 # Single-level subsection (e.g., 11B-216.5)
                 # Parent is the section
@@ -539,22 +638,12 @@ def upload_unified_code(code_data: Dict[str, Any], supabase: Client):
             }
             all_items.append(subsection_item)
 
-    upload_items_to_supabase(supabase, all_items, code_data, code_id)
+    await upload_items_to_supabase(supabase, all_items, code_data, code_id)
 
     logger.info(f"Supabase upload complete for {provider} {source_id} v{version}.")
 
 
-def main():
-    parser = argparse.ArgumentParser(
-        description="Upload building code data to Supabase from unified Code schema JSON"
-    )
-    parser.add_argument(
-        "--file",
-        required=True,
-        help="Path to JSON file in unified Code schema format. Can be local or s3://bucket/key",
-    )
-    args = parser.parse_args()
-
+async def main_async(args):
     # Initialize Supabase client
     supabase_url = os.environ.get("NEXT_PUBLIC_SUPABASE_URL")
     supabase_key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
@@ -564,7 +653,7 @@ def main():
             "Missing Supabase credentials. Set NEXT_PUBLIC_SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY"
         )
 
-    supabase: Client = create_client(supabase_url, supabase_key)
+    supabase: AsyncClient = await create_async_client(supabase_url, supabase_key)
     logger.info("Connected to Supabase")
 
     code_data = load_data_from_path(args.file)
@@ -575,8 +664,22 @@ def main():
         if field not in code_data:
             raise ValueError(f"Invalid Code schema: missing required field '{field}'")
 
-    upload_unified_code(code_data, supabase)
+    await upload_unified_code(code_data, supabase)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Upload building code data to Supabase from unified Code schema JSON"
+    )
+    parser.add_argument(
+        "--file",
+        required=True,
+        help="Path to JSON file in unified Code schema format. Can be local or s3://bucket/key",
+    )
+    args = parser.parse_args()
+
+    asyncio.run(main_async(args))
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -11,11 +11,16 @@ Usage:
 
 import os
 import sys
-import json
+import asyncio
+from collections import Counter
 from typing import Dict, List, Tuple
-from supabase import create_client, Client
+from supabase import create_async_client, AsyncClient
+from fast_json import loads
 
-def get_supabase_client():
+# Max in-flight PostgREST requests when batches are sent concurrently
+MAX_CONCURRENT_REQUESTS = 16
+
+async def get_supabase_client():
     url = os.getenv('NEXT_PUBLIC_SUPABASE_URL')
     key = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
     if not url or not key:
@@ -23,77 +28,83 @@ def get_supabase_client():
         print("  - NEXT_PUBLIC_SUPABASE_URL")
         print("  - SUPABASE_SERVICE_ROLE_KEY")
         sys.exit(1)
-    return create_client(url, key)
+    return await create_async_client(url, key)
 
-def get_element_group_map(supabase: Client) -> Dict[str, str]:
+async def get_element_group_map(supabase: AsyncClient) -> Dict[str, str]:
     """Fetch element group slugs -> IDs"""
-    response = supabase.table('element_groups').select('id, slug').execute()
+    response = await supabase.table('element_groups').select('id, slug').execute()
     return {row['slug']: row['id'] for row in response.data}
 
-def get_section_keys(supabase: Client, section_ids: List[str]) -> Dict[str, str]:
+async def get_section_keys(supabase: AsyncClient, section_ids: List[str]) -> Dict[str, str]:
     """Fetch section keys for given section IDs"""
     section_map = {}
     batch_size = 100  # Keep it small to avoid API limits
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
     
-    for i in range(0, len(section_ids), batch_size):
-        batch = section_ids[i:i+batch_size]
-        response = supabase.table('sections') \
-            .select('id, key') \
-            .in_('id', batch) \
-            .execute()
+    async def fetch_batch(batch: List[str]):
+        async with semaphore:
+            response = await supabase.table('sections') \
+                .select('id, key') \
+                .in_('id', batch) \
+                .execute()
         
         for row in response.data:
             section_map[row['id']] = row['key']
-        
-        if (i + batch_size) % 1000 == 0:
-            print(f"   Fetched {i + batch_size}/{len(section_ids)}...")
+    
+    await asyncio.gather(*[
+        fetch_batch(section_ids[i:i+batch_size])
+        for i in range(0, len(section_ids), batch_size)
+    ])
     
     return section_map
 
-def save_mappings(supabase: Client, mappings: List[Tuple[str, str, str]]):
+async def save_mappings(supabase: AsyncClient, mappings: List[Tuple[str, str, str]]):
     """
     Save element-section mappings to database
     mappings: List of (section_id, section_key, element_group_id) tuples
+    
+    Each chunk is replaced atomically by the replace_element_mappings RPC
+    (delete existing mappings for its sections, then insert the new ones).
     """
     print(f"\n💾 Saving {len(mappings)} mappings to database...")
     
-    # Clear existing mappings for these sections (we'll rebuild from scratch)
-    section_ids = list(set([m[0] for m in mappings]))
-    
-    if section_ids:
-        # Delete old mappings in batches
-        batch_size = 100
-        for i in range(0, len(section_ids), batch_size):
-            batch = section_ids[i:i+batch_size]
-            supabase.table('element_section_mappings') \
-                .delete() \
-                .in_('section_id', batch) \
-                .execute()
+    # Group by section so one section's mappings never straddle two transactions
+    records_by_section: Dict[str, List[Dict[str, str]]] = {}
+    for section_id, section_key, element_id in mappings:
+        records_by_section.setdefault(section_id, []).append({
+            'section_id': section_id,
+            'section_key': section_key,
+            'element_group_id': element_id
+        })
+    
+    chunks = []
+    chunk = []
+    batch_size = 5000
+    for records in records_by_section.values():
+        chunk.extend(records)
+        if len(chunk) >= batch_size:
+            chunks.append(chunk)
+            chunk = []
+    if chunk:
+        chunks.append(chunk)
     
-    # Insert new mappings in batches
     inserted = 0
-    batch_size = 100
-    
-    for i in range(0, len(mappings), batch_size):
-        batch = mappings[i:i+batch_size]
-        records = [
-            {
-                'section_id': section_id,
-                'section_key': section_key,
-                'element_group_id': element_id
-            }
-            for section_id, section_key, element_id in batch
-        ]
-        
-        try:
-            supabase.table('element_section_mappings').insert(records).execute()
-            inserted += len(records)
-        except Exception as e:
-            print(f"⚠️  Error inserting batch: {e}")
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    
+    async def replace_chunk(records: List[Dict[str, str]]):
+        nonlocal inserted
+        async with semaphore:
+            try:
+                response = await supabase.rpc('replace_element_mappings', {'p_mappings': records}).execute()
+                inserted += response.data
+            except Exception as e:
+                print(f"⚠️  Error replacing mappings batch: {e}")
+    
+    await asyncio.gather(*[replace_chunk(records) for records in chunks])
     
     print(f"✅ Saved {inserted} mappings")
 
-def main():
+async def main_async():
     print("=" * 80)
     print("Load Element Tagging Results")
     print("=" * 80)
@@ -106,16 +117,16 @@ def main():
         sys.exit(1)
     
     print(f"📂 Loading results from {results_file}...")
-    with open(results_file, 'r') as f:
-        data = json.load(f)
+    with open(results_file, 'rb') as f:
+        data = loads(f.read())
     
     classifications = data.get('classifications', {})
     print(f"✅ Loaded {len(classifications)} classified sections")
     print()
     
     # Initialize
-    supabase = get_supabase_client()
-    element_map = get_element_group_map(supabase)
+    supabase = await get_supabase_client()
+    element_map = await get_element_group_map(supabase)
     
     print(f"📋 Element groups found: {', '.join(element_map.keys())}")
     print()
@@ -123,14 +134,14 @@ def main():
     # Get section keys
     section_ids = list(classifications.keys())
     print(f"🔍 Fetching section keys for {len(section_ids)} sections...")
-    section_lookup = get_section_keys(supabase, section_ids)
+    section_lookup = await get_section_keys(supabase, section_ids)
     print(f"✅ Found keys for {len(section_lookup)} sections")
     print()
     
     # Build mappings
     print("📊 Building element-section mappings...")
     mappings = []
-    stats = {}
+    stats = Counter()
     missing_keys = 0
     
     for section_id, element_types in classifications.items():
@@ -139,15 +150,9 @@ def main():
             missing_keys += 1
             continue
             
-        for element_type in element_types:
-            if element_type in element_map:
-                element_group_id = element_map[element_type]
-                mappings.append((section_id, section_key, element_group_id))
-                
-                # Track stats
-                if element_type not in stats:
-                    stats[element_type] = 0
-                stats[element_type] += 1
+        valid_types = [t for t in element_types if t in element_map]
+        stats.update(valid_types)
+        mappings.extend((section_id, section_key, element_map[t]) for t in valid_types)
     
     if missing_keys > 0:
         print(f"⚠️  Warning: {missing_keys} sections had no key, skipped")
@@ -164,13 +169,16 @@ def main():
     
     # Save to database
     if mappings:
-        save_mappings(supabase, mappings)
+        await save_mappings(supabase, mappings)
         print("\n✅ Done! Element-section mappings updated.")
     else:
         print("\n⚠️  No mappings generated")
     
     print()
 
+def main():
+    asyncio.run(main_async())
+
 if __name__ == '__main__':
     main()
 
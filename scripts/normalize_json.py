@@ -5,10 +5,11 @@ Useful for preparing baseline files for comparison.
 Usage: python normalize_json.py cbc_2025.json
 """
 
-import json
 import sys
 from pathlib import Path
 
+from fast_json import dump_json, load_json
+
 
 def sort_code_data(data: dict) -> dict:
     """Sort all data structures in the code data for deterministic output."""
@@ -53,8 +54,7 @@ def main():
     
     # Read JSON
     print(f"Reading {input_file}...")
-    with open(input_file, "r") as f:
-        data = json.load(f)
+    data = load_json(input_file)
     
     # Sort data
     print("Sorting data structures...")
@@ -65,8 +65,7 @@ def main():
     
     # Write sorted JSON
     print(f"Writing to {output_file}...")
-    with open(output_file, "w") as f:
-        json.dump(data, f, indent=2, sort_keys=True)
+    dump_json(data, output_file, sort_keys=True)
     
     print(f"✅ Done! Normalized JSON saved to: {output_file}")
     print(f"\nTo replace original:")
@@ -4,15 +4,35 @@ Parse California Plumbing Code markdown files using Gemini 3 Pro.
 Converts messy CPC markdown to unified JSON schema format.
 """
 
+import hashlib
 import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import List, Optional
 from google import genai
-from google.genai import types
+from google.genai import errors, types
+from pydantic import Field
+from schema import Code, Section
 
 # Initialize Gemini client
 client = genai.Client(api_key=os.environ.get("GOOGLE_API_KEY") or os.environ.get("GEMINI_API_KEY"))
 
+MODEL = "gemini-3-pro-preview"
+
+# Bump to invalidate cached Gemini responses (e.g. after changing the parsing config)
+CACHE_VERSION = "3"
+
+# Files parsed concurrently (keep under the model's per-minute request limit)
+MAX_WORKERS = 8
+
+# Retries for rate limits (429) and server errors (5xx), with exponential backoff
+MAX_RETRIES = 5
+
+# Re-asks when Gemini answers with no text (safety block or empty candidate)
+EMPTY_RESPONSE_RETRIES = 2
+
 PARSING_PROMPT = """
 You are parsing the California Plumbing Code 2022 into a structured JSON format.
 
@@ -67,50 +87,130 @@ Parse the provided markdown content into this exact JSON schema:
 **Output only valid JSON. No explanations, no markdown code blocks, just the raw JSON.**
 """
 
-def parse_cpc_file(file_path: Path) -> dict:
-    """Parse a single CPC markdown file using Gemini 3 Pro."""
+class CpcSection(Section):
+    """Section shape Gemini must return; the CPC prompt also asks for section text."""
+    text: str = ""
+
+class CpcDocument(Code):
+    """Top-level unified Code document for one CPC markdown file."""
+    sections: List[CpcSection] = Field(default_factory=list)
+
+def generate_content_with_retry(**kwargs):
+    """Call Gemini, retrying 429 and 5xx responses with exponential backoff."""
+    for attempt in range(MAX_RETRIES):
+        try:
+            return client.models.generate_content(**kwargs)
+        except errors.APIError as e:
+            retryable = e.code == 429 or e.code >= 500
+            if not retryable or attempt == MAX_RETRIES - 1:
+                raise
+            delay = 2 ** (attempt + 1)
+            print(f"  ⚠ Gemini returned {e.code}, retry {attempt + 1}/{MAX_RETRIES} in {delay}s", flush=True)
+            time.sleep(delay)
+
+def parse_cpc_file(file_path: Path, cache_dir: Optional[Path] = None) -> dict:
+    """
+    Parse a single CPC markdown file using Gemini 3 Pro.
+
+    If cache_dir is given, responses are cached there by a hash of the model,
+    prompt and markdown content, so unchanged files are not re-sent to Gemini.
+    """
     print(f"Parsing {file_path.name}...", flush=True)
 
     with open(file_path, 'r', encoding='utf-8') as f:
         content = f.read()
 
+    cache_path = None
+    if cache_dir:
+        cache_key = hashlib.sha256(
+            "\n".join([CACHE_VERSION, MODEL, PARSING_PROMPT, content]).encode("utf-8")
+        ).hexdigest()
+        cache_path = cache_dir / f"{cache_key}.json"
+        if cache_path.exists():
+            parsed_data = json.loads(cache_path.read_text(encoding="utf-8"))
+            print(f"  ✓ Loaded {len(parsed_data.get('sections', []))} sections from cache", flush=True)
+            return parsed_data
+
     # Send to Gemini 3 Pro
-    response = client.models.generate_content(
-        model="gemini-3-pro-preview",
-        contents=[
-            types.Content(
-                role="user",
-                parts=[
-                    types.Part(text=PARSING_PROMPT),
-                    types.Part(text=f"\n\nMarkdown content to parse:\n\n{content}")
-                ]
+    for attempt in range(EMPTY_RESPONSE_RETRIES + 1):
+        response = generate_content_with_retry(
+            model=MODEL,
+            contents=[
+                types.Content(
+                    role="user",
+                    parts=[
+                        types.Part(text=PARSING_PROMPT),
+                        types.Part(text=f"\n\nMarkdown content to parse:\n\n{content}")
+                    ]
+                )
+            ],
+            config=types.GenerateContentConfig(
+                temperature=0.0,  # Deterministic parsing
+                max_output_tokens=100000,  # Large output for full chapters
+                # Structured output: Gemini returns bare JSON matching the schema, no code fences
+                response_mime_type="application/json",
+                response_schema=CpcDocument,
             )
-        ],
-        config=types.GenerateContentConfig(
-            temperature=0.0,  # Deterministic parsing
-            max_output_tokens=100000,  # Large output for full chapters
         )
-    )
-
-    # Parse JSON response
-    response_text = response.text.strip()
 
-    # Remove markdown code blocks if present (just in case)
-    if response_text.startswith("```"):
-        lines = response_text.split("\n")
-        response_text = "\n".join(lines[1:-1]) if len(lines) > 2 else response_text
-        if response_text.startswith("json"):
-            response_text = response_text[4:].strip()
+        # response.text is None when the prompt was blocked or the candidate came back empty
+        response_text = response.text
+        if response_text:
+            break
+        reason = response.candidates[0].finish_reason if response.candidates else response.prompt_feedback
+        print(f"  ⚠ Gemini returned no text ({reason}), attempt {attempt + 1}/{EMPTY_RESPONSE_RETRIES + 1}", flush=True)
+    else:
+        raise ValueError(f"Gemini returned no text for {file_path.name}")
 
+    # Parse JSON response
     try:
         parsed_data = json.loads(response_text)
         print(f"  ✓ Successfully parsed {len(parsed_data.get('sections', []))} sections", flush=True)
-        return parsed_data
     except json.JSONDecodeError as e:
         print(f"  ✗ Failed to parse JSON response: {e}", flush=True)
         print(f"  Response preview: {response_text[:500]}...", flush=True)
         raise
 
+    if cache_path:
+        # Write then rename so an interrupted run never leaves a truncated entry
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(parsed_data, ensure_ascii=False), encoding="utf-8")
+        tmp_path.replace(cache_path)
+
+    return parsed_data
+
+def load_manifest(manifest_path: Path) -> dict:
+    """Load the {md filename: {status, output_path, hash}} manifest from a previous run."""
+    if manifest_path.exists():
+        return json.loads(manifest_path.read_text(encoding="utf-8"))
+    return {}
+
+def save_manifest(manifest: dict, manifest_path: Path):
+    """Write the manifest atomically so a crash never leaves it half-written."""
+    tmp_path = manifest_path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    tmp_path.replace(manifest_path)
+
+def is_done(manifest: dict, md_file: Path, file_hash: str) -> bool:
+    """True if this exact file content was already parsed and its output still exists."""
+    entry = manifest.get(md_file.name, {})
+    return (
+        entry.get("status") == "done"
+        and entry.get("hash") == file_hash
+        and Path(entry.get("output_path", "")).exists()
+    )
+
+def parse_and_save(md_file: Path, output_dir: Path) -> Path:
+    """Parse one markdown file and write its JSON next to the others."""
+    parsed_data = parse_cpc_file(md_file, cache_dir=output_dir / ".cache")
+
+    output_file = output_dir / f"{md_file.stem}_parsed.json"
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(parsed_data, f, indent=2, ensure_ascii=False)
+
+    return output_file
+
 def main():
     cpc_dir = Path("/Users/will/code/service/cpc")
     output_dir = Path("/Users/will/code/service/output")
@@ -120,20 +220,32 @@ def main():
     md_files = sorted(cpc_dir.glob("*.md"))
     print(f"Found {len(md_files)} CPC markdown files", flush=True)
 
-    for md_file in md_files:
-        try:
-            parsed_data = parse_cpc_file(md_file)
-
-            # Save to output
-            output_file = output_dir / f"{md_file.stem}_parsed.json"
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(parsed_data, f, indent=2, ensure_ascii=False)
-
-            print(f"  ✓ Saved to {output_file}\n", flush=True)
-
-        except Exception as e:
-            print(f"  ✗ Error processing {md_file.name}: {e}\n", flush=True)
-            continue
+    # Skip files already parsed by a previous (possibly interrupted) run
+    manifest_path = output_dir / "manifest.json"
+    manifest = load_manifest(manifest_path)
+    file_hashes = {md_file: hashlib.sha256(md_file.read_bytes()).hexdigest() for md_file in md_files}
+    pending = [md_file for md_file in md_files if not is_done(manifest, md_file, file_hashes[md_file])]
+    if len(pending) < len(md_files):
+        print(f"Skipping {len(md_files) - len(pending)} files already parsed", flush=True)
+
+    # Parse files in parallel; each call spends seconds to minutes waiting on Gemini
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {executor.submit(parse_and_save, md_file, output_dir): md_file for md_file in pending}
+
+        for future in as_completed(futures):
+            md_file = futures[future]
+            try:
+                output_file = future.result()
+                # Only this thread touches the manifest, so no lock is needed
+                manifest[md_file.name] = {
+                    "status": "done",
+                    "output_path": str(output_file),
+                    "hash": file_hashes[md_file],
+                }
+                save_manifest(manifest, manifest_path)
+                print(f"  ✓ Saved {md_file.name} to {output_file}\n", flush=True)
+            except Exception as e:
+                print(f"  ✗ Error processing {md_file.name}: {e}\n", flush=True)
 
 if __name__ == "__main__":
     main()
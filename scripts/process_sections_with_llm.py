@@ -17,15 +17,24 @@ Usage:
 
     # Custom models
     python scripts/process_sections_with_llm.py --input sections.json --filter-model gpt-4o-mini --question-model gpt-4o
+
+    # Re-run from cached responses only (no API calls; fails on cache miss)
+    python scripts/process_sections_with_llm.py --input sections.json --cache-mode replay
 """
 
 import json
 import argparse
 import time
 import asyncio
+import hashlib
 import random
+import tempfile
+from collections import defaultdict
 from datetime import timedelta
-from litellm import acompletion, RateLimitError
+from pathlib import Path
+from types import SimpleNamespace
+from fast_json import dump_json, dumps, load_json, loads
+from litellm import acompletion, encode, decode, RateLimitError, InternalServerError, ServiceUnavailableError, Timeout
 
 # ---------------------------
 # Project Context
@@ -56,62 +65,352 @@ QUESTION_MODEL_FALLBACKS = [
     'gpt-4o-mini'
 ]
 
+# ---------------------------
+# Response Cache
+# ---------------------------
+
+# Prompts are deterministic per (messages, model, temperature), so re-runs can replay
+# earlier responses from disk. Modes:
+#   enabled    - read hits, call the API on misses and store the result
+#   replay     - read hits, raise on misses (guarantees zero API calls)
+#   write-only - always call the API, store the result
+#   disabled   - no caching
+CACHE_MODES = ['enabled', 'replay', 'write-only', 'disabled']
+LLM_CACHE = {
+    'mode': 'enabled',
+    'dir': Path('.llm_cache'),
+}
+
+def cache_key(model, messages, temperature, response_format):
+    """SHA256 over everything that determines the response (stdlib json keeps keys stable)."""
+    payload = json.dumps(
+        [messages, model, temperature, response_format], sort_keys=True
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def read_cached_response(key):
+    """Return a response-shaped object for a cached completion, or None on miss."""
+    cache_path = LLM_CACHE['dir'] / f"{key}.json"
+    if not cache_path.exists():
+        return None
+    content = loads(cache_path.read_bytes())['content']
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+def write_cached_response(key, response):
+    """Store the completion text; write via rename so concurrent runs never see partial files."""
+    LLM_CACHE['dir'].mkdir(parents=True, exist_ok=True)
+    cache_path = LLM_CACHE['dir'] / f"{key}.json"
+    # Unique temp name: concurrent workers writing the same key must not share one
+    with tempfile.NamedTemporaryFile(
+        'w', dir=LLM_CACHE['dir'], suffix='.tmp', delete=False, encoding='utf-8'
+    ) as tmp:
+        tmp.write(dumps({'content': response.choices[0].message.content}))
+    Path(tmp.name).replace(cache_path)
+
+def reply_has_keys(content, keys):
+    """True if content is a JSON object containing every key."""
+    try:
+        result = loads(content)
+    except ValueError:
+        return False
+    return isinstance(result, dict) and all(k in result for k in keys)
+
+# ---------------------------
+# Rate Limiting
+# ---------------------------
+
+class TokenBucket:
+    """
+    Token-bucket limiter over requests/minute and tokens/minute.
+
+    Both buckets refill continuously; acquire() sleeps until there is room for
+    one more request of the estimated size, so bursts are smoothed to the
+    provider limit instead of tripping 429s and exponential backoff.
+    A limit of None leaves that dimension unbounded.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.request_tokens = requests_per_minute or 0
+        self.token_tokens = tokens_per_minute or 0
+        self.last_update = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_update
+        self.last_update = now
+        if self.requests_per_minute:
+            self.request_tokens = min(
+                self.requests_per_minute,
+                self.request_tokens + elapsed * self.requests_per_minute / 60
+            )
+        if self.tokens_per_minute:
+            self.token_tokens = min(
+                self.tokens_per_minute,
+                self.token_tokens + elapsed * self.tokens_per_minute / 60
+            )
+
+    async def acquire(self, estimated_tokens):
+        """Wait until one request of estimated_tokens fits in both buckets, then take it."""
+        if self.tokens_per_minute:
+            # A single request larger than the whole bucket would otherwise wait forever
+            estimated_tokens = min(estimated_tokens, self.tokens_per_minute)
+
+        async with self.lock:
+            while True:
+                self._refill()
+
+                wait_time = 0.0
+                if self.requests_per_minute and self.request_tokens < 1:
+                    wait_time = max(wait_time, (1 - self.request_tokens) * 60 / self.requests_per_minute)
+                if self.tokens_per_minute and self.token_tokens < estimated_tokens:
+                    wait_time = max(wait_time, (estimated_tokens - self.token_tokens) * 60 / self.tokens_per_minute)
+
+                if wait_time <= 0:
+                    if self.requests_per_minute:
+                        self.request_tokens -= 1
+                    if self.tokens_per_minute:
+                        self.token_tokens -= estimated_tokens
+                    return
+
+                await asyncio.sleep(wait_time)
+
+# Set in main_async when --rpm/--tpm are given
+RATE_LIMITER = None
+
+# Upper bound on a single acompletion attempt; a hung connection is treated like a
+# rate limit (backoff, then fallback) instead of holding a concurrency slot indefinitely
+PER_ATTEMPT_TIMEOUT = 30.0
+
+class CircuitBreaker:
+    """
+    Per-model CLOSED -> OPEN -> HALF_OPEN breaker.
+
+    After failure_threshold consecutive rate-limit/5xx failures a model is
+    skipped (OPEN) for reset_timeout seconds, so callers go straight to the
+    next fallback instead of sitting through the whole backoff ladder. After
+    that a single probe request is let through (HALF_OPEN); success closes
+    the breaker, failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = defaultdict(int)
+        self.opened_at = {}
+        self.probing = set()
+
+    def allow(self, model):
+        opened_at = self.opened_at.get(model)
+        if opened_at is None:
+            return True
+        if time.monotonic() - opened_at < self.reset_timeout:
+            return False
+        # Half-open: only one in-flight probe per model
+        if model in self.probing:
+            return False
+        self.probing.add(model)
+        return True
+
+    def cooldown_remaining(self, model):
+        """Seconds until an open breaker lets a probe through (0 if closed)."""
+        opened_at = self.opened_at.get(model)
+        if opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - opened_at))
+
+    def release_probe(self, model):
+        """Free the half-open slot after a probe that neither succeeded nor failed retryably."""
+        self.probing.discard(model)
+
+    def record_success(self, model):
+        self.failures.pop(model, None)
+        self.opened_at.pop(model, None)
+        self.probing.discard(model)
+
+    def record_failure(self, model):
+        self.failures[model] += 1
+        if model in self.probing or self.failures[model] >= self.failure_threshold:
+            self.opened_at[model] = time.monotonic()
+            self.probing.discard(model)
+
+CIRCUIT_BREAKER = CircuitBreaker()
+
+# Models whose quota is gone for the day; skipped for the rest of the run
+EXHAUSTED_MODELS = set()
+
+# Consecutive daily-quota errors before a model is marked exhausted
+QUOTA_EXHAUSTED_THRESHOLD = 3
+QUOTA_ERROR_COUNTS = defaultdict(int)
+
+def is_quota_exhausted(error):
+    """
+    True for rate-limit errors that won't clear within a retry window.
+
+    Only daily/billing signals count: Gemini's per-minute 429 also mentions
+    "quota" ("Resource has been exhausted (e.g. check quota)").
+    """
+    message = str(error).lower()
+    return (
+        'insufficient_quota' in message
+        or 'perday' in message
+        or 'per day' in message
+        or 'daily' in message
+    )
+
+def record_quota_error(model, error):
+    """Track consecutive daily-quota errors; True once the model should be skipped for the run."""
+    if isinstance(error, RateLimitError) and is_quota_exhausted(error):
+        QUOTA_ERROR_COUNTS[model] += 1
+        return QUOTA_ERROR_COUNTS[model] >= QUOTA_EXHAUSTED_THRESHOLD
+    QUOTA_ERROR_COUNTS.pop(model, None)
+    return False
+
+def estimate_tokens(messages):
+    """Rough prompt+completion size: ~4 chars per token plus room for the reply."""
+    return sum(len(m['content']) for m in messages) // 4 + 500
+
 # ---------------------------
 # Retry Logic
 # ---------------------------
 
-async def call_llm_with_retry(model, messages, temperature, max_retries=5, fallback_models=None):
+# Longest single wait between retries, including provider-requested Retry-After
+MAX_BACKOFF_SECONDS = 60.0
+
+def retry_after_seconds(error):
+    """Seconds from the provider's Retry-After header, or 0 if absent/unparseable."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return 0.0
+    try:
+        return float(headers.get('retry-after', 0))
+    except (TypeError, ValueError):
+        # HTTP-date form is rare for LLM APIs; fall back to jittered backoff
+        return 0.0
+
+async def call_llm_with_retry(model, messages, temperature, max_retries=5, fallback_models=None, validate=None):
     """
     Call LLM with exponential backoff retry and model fallback.
 
     If rate limit hit:
     1. Retry with exponential backoff
     2. If retries exhausted, try fallback models
+
+    Responses are cached under the requested model (see LLM_CACHE), even when
+    a fallback model produced them. If validate is given, only replies whose
+    content passes it are cached or served from the cache, so a malformed
+    reply is retried on the next run instead of replayed forever.
     """
+    response_format = {"type": "json_object"}
+    mode = LLM_CACHE['mode']
+    key = None
+    if mode != 'disabled':
+        key = cache_key(model, messages, temperature, response_format)
+        if mode in ('enabled', 'replay'):
+            cached = read_cached_response(key)
+            if cached is not None and (validate is None or validate(cached.choices[0].message.content)):
+                return cached
+            if mode == 'replay':
+                raise Exception(f"Cache miss in replay mode for {model} (key {key[:12]})")
+
     models_to_try = [model]
     if fallback_models:
         models_to_try.extend(fallback_models)
 
     for model_index, current_model in enumerate(models_to_try):
+        if current_model in EXHAUSTED_MODELS:
+            continue
+
         retries = 0
         base_delay = 1.0
 
         while retries < max_retries:
+            if not CIRCUIT_BREAKER.allow(current_model):
+                if model_index < len(models_to_try) - 1:
+                    print(f"    ⚠ Circuit open for {current_model}, skipping to fallback...")
+                    break  # Try next model
+                # Nothing left to fall back to: wait out the cooldown instead of dropping the section
+                wait = max(1.0, CIRCUIT_BREAKER.cooldown_remaining(current_model))
+                print(f"    ⚠ Circuit open for {current_model}, waiting {wait:.1f}s...")
+                await asyncio.sleep(wait)
+                continue
+
+            # allow() only leaves the model in probing when this call is the half-open probe
+            is_probe = current_model in CIRCUIT_BREAKER.probing
+
+            if RATE_LIMITER:
+                await RATE_LIMITER.acquire(estimate_tokens(messages))
+
             try:
-                response = await acompletion(
-                    model=current_model,
-                    messages=messages,
-                    temperature=temperature,
-                    response_format={"type": "json_object"}
+                # wait_for also bounds time spent outside the HTTP call (e.g. provider SDK retries)
+                response = await asyncio.wait_for(
+                    acompletion(
+                        model=current_model,
+                        messages=messages,
+                        temperature=temperature,
+                        response_format=response_format,
+                        timeout=PER_ATTEMPT_TIMEOUT
+                    ),
+                    timeout=PER_ATTEMPT_TIMEOUT
                 )
 
+                CIRCUIT_BREAKER.record_success(current_model)
+                QUOTA_ERROR_COUNTS.pop(current_model, None)
+
                 # Success! Log if we used a fallback
                 if model_index > 0:
                     print(f"    → Used fallback model: {current_model}")
 
+                if key and (validate is None or validate(response.choices[0].message.content)):
+                    write_cached_response(key, response)
+
                 return response
 
-            except RateLimitError as e:
+            except (RateLimitError, InternalServerError, ServiceUnavailableError, Timeout, asyncio.TimeoutError) as e:
+                CIRCUIT_BREAKER.record_failure(current_model)
                 retries += 1
 
-                # Calculate exponential backoff with jitter
-                delay = base_delay * (2 ** retries) + random.uniform(0, 1)
+                if record_quota_error(current_model, e):
+                    print(f"    ⚠ Quota exhausted for {current_model}, skipping it for the rest of the run")
+                    EXHAUSTED_MODELS.add(current_model)
+                    break  # Try next model
+
+                # Full jitter decorrelates concurrent tasks so they don't retry in lockstep;
+                # never retry sooner than the provider asked us to, but a bogus Retry-After
+                # must not stall the worker past the backoff ceiling
+                delay = min(
+                    max(
+                        random.uniform(0, min(MAX_BACKOFF_SECONDS, base_delay * (2 ** retries))),
+                        retry_after_seconds(e)
+                    ),
+                    MAX_BACKOFF_SECONDS
+                )
 
                 if retries < max_retries:
-                    print(f"    ⚠ Rate limit hit for {current_model}, retry {retries}/{max_retries} in {delay:.1f}s")
+                    print(f"    ⚠ {type(e).__name__} for {current_model}, retry {retries}/{max_retries} in {delay:.1f}s")
                     await asyncio.sleep(delay)
                 else:
                     # Retries exhausted for this model
                     if model_index < len(models_to_try) - 1:
-                        print(f"    ⚠ Rate limit retries exhausted for {current_model}, trying fallback...")
+                        print(f"    ⚠ Retries exhausted for {current_model}, trying fallback...")
                         break  # Try next model
                     else:
                         # No more fallbacks
                         print(f"    ✗ All models exhausted, giving up")
                         raise e
 
+            except asyncio.CancelledError:
+                if is_probe:
+                    CIRCUIT_BREAKER.release_probe(current_model)
+                raise
+
             except Exception as e:
-                # Non-rate-limit error, don't retry
+                # Non-rate-limit error, don't retry; a probe must not keep the breaker half-open forever
+                if is_probe:
+                    CIRCUIT_BREAKER.release_probe(current_model)
                 print(f"    ✗ Error with {current_model}: {e}")
                 raise e
 
@@ -121,19 +420,7 @@ async def call_llm_with_retry(model, messages, temperature, max_retries=5, fallb
 # Phase 1: Filter Prompt
 # ---------------------------
 
-def build_filter_prompt(section_data):
-    """
-    Build the YES/NO filter prompt.
-    Look for ambiguous language or explicit city requirements.
-    """
-    section = section_data['section_data']
-
-    prompt = f"""Does this California Building Code section require consultation with Sacramento Building Department?
-
-Section {section_data['section_number']}: {section_data['section_title']}
-{section_data['section_text'][:300]}{"..." if len(section_data['section_text']) > 300 else ""}
-
-ONLY flag as needs_consultation=true if:
+FILTER_CRITERIA = """ONLY flag as needs_consultation=true if:
 - Section explicitly says "as approved by building official" or "as determined by authority having jurisdiction"
 - Contains undefined terms that could be interpreted multiple ways (e.g., "sufficient", "adequate", "reasonable" without specific criteria)
 - References local amendments or Sacramento-specific policies
@@ -145,7 +432,48 @@ DO NOT flag if:
 - Section is just defining terms or referencing other sections
 - Requirements are standard and don't need local interpretation
 
-95% of sections should be NO. Only flag truly ambiguous sections.
+95% of sections should be NO. Only flag truly ambiguous sections."""
+
+# Token budget for the section excerpt in Phase 1 prompts
+FILTER_TEXT_TOKEN_BUDGET = 150
+
+# Phase 2 sees the whole section, but a few very long sections shouldn't dominate cost
+QUESTION_TEXT_TOKEN_BUDGET = 2000
+
+# Tokenizer used for budgeting; litellm bundles it, so no download is needed
+TOKENIZER_MODEL = 'gpt-4o-mini'
+
+def truncate_section_text(text, budget=FILTER_TEXT_TOKEN_BUDGET, log_label=None):
+    """
+    Trim text to a token budget, keeping its start and end.
+
+    Discretionary language ("as approved by the building official") often sits
+    at the end of a section, so a plain prefix cut would lose it.
+    If log_label is given, truncation is logged under that label.
+    """
+    tokens = encode(model=TOKENIZER_MODEL, text=text)
+    if len(tokens) <= budget:
+        return text
+    if log_label:
+        print(f"    ✂ Truncated {log_label} from {len(tokens)} to ~{budget} tokens")
+    half = budget // 2
+    head = decode(model=TOKENIZER_MODEL, tokens=tokens[:half])
+    tail = decode(model=TOKENIZER_MODEL, tokens=tokens[-half:])
+    return f"{head} ... {tail}"
+
+def build_filter_prompt(section_data):
+    """
+    Build the YES/NO filter prompt.
+    Look for ambiguous language or explicit city requirements.
+    """
+    section = section_data['section_data']
+
+    prompt = f"""Does this California Building Code section require consultation with Sacramento Building Department?
+
+Section {section_data['section_number']}: {section_data['section_title']}
+{truncate_section_text(section_data['section_text'])}
+
+{FILTER_CRITERIA}
 
 Return JSON:
 {{
@@ -155,6 +483,35 @@ Return JSON:
 
     return prompt
 
+def build_filter_prompt_batch(section_batch):
+    """
+    Build one filter prompt covering several sections.
+    Sections are tagged with their index so results can be mapped back.
+    """
+    sections_text = "\n\n".join(
+        f"[id {i}] Section {section_data['section_number']}: {section_data['section_title']}\n"
+        f"{truncate_section_text(section_data['section_text'])}"
+        for i, section_data in enumerate(section_batch)
+    )
+
+    prompt = f"""For each California Building Code section below, does it require consultation with Sacramento Building Department?
+
+{sections_text}
+
+Judge each section independently.
+
+{FILTER_CRITERIA}
+
+Return JSON with exactly one result per section id:
+{{
+  "results": [
+    {{"id": 0, "needs_consultation": true|false, "reason": "brief explanation"}},
+    ...
+  ]
+}}"""
+
+    return prompt
+
 # ---------------------------
 # Phase 2: Question Generation Prompt
 # ---------------------------
@@ -162,28 +519,32 @@ Return JSON:
 def build_questions_prompt(section_data):
     """
     Build detailed question generation prompt.
-    Only called for sections flagged in Phase 1.
+    Only called for sections flagged in Phase 1 (uses the flattened Phase 1 record).
     """
-    section = section_data['section_data']
-    references = section['section_references']
+    references = section_data['section_references']
+
+    section_text = truncate_section_text(
+        section_data['section_text'], QUESTION_TEXT_TOKEN_BUDGET, log_label=section_data['section_number']
+    )
 
     # Build references section
     references_text = ""
     if references:
-        references_text = "\n\nREFERENCED SECTIONS:\n"
+        parts = ["\n\nREFERENCED SECTIONS:\n"]
         for ref in references:
             target = ref['target_section']
             citation = ref.get('citation_text', '')
-            references_text += f"\n- {target['number']}: {target['title']}"
+            parts.append(f"\n- {target['number']}: {target['title']}")
             if citation:
-                references_text += f" (Citation: {citation})"
+                parts.append(f" (Citation: {citation})")
+        references_text = "".join(parts)
 
     prompt = f"""Generate specific questions to ask Sacramento Building Department about this code section.
 
 Project: 20,000 sqft storage facility in Sacramento, CA
 
 Section {section_data['section_number']}: {section_data['section_title']}
-{section_data['section_text']}
+{section_text}
 {references_text}
 
 Generate:
@@ -224,11 +585,16 @@ async def process_filter(section_data, model):
             {"role": "user", "content": prompt}
         ],
         temperature=0.1,
-        fallback_models=fallbacks
+        fallback_models=fallbacks,
+        validate=lambda content: reply_has_keys(content, ['needs_consultation'])
     )
 
-    result = json.loads(response.choices[0].message.content)
+    result = loads(response.choices[0].message.content)
+
+    return build_filter_result(section_data, result['needs_consultation'], result.get('reason', ''))
 
+def build_filter_result(section_data, needs_consultation, filter_reason):
+    """Phase 1 output record for one section."""
     section = section_data['section_data']
 
     return {
@@ -238,11 +604,60 @@ async def process_filter(section_data, model):
         'section_title': section_data['section_title'],
         'section_text': section_data['section_text'],
         'section_references': section['section_references'],
-        'needs_consultation': result['needs_consultation'],
-        'filter_reason': result['reason'],
-        'section_data': section_data['section_data']  # Keep for phase 2
+        'needs_consultation': needs_consultation,
+        'filter_reason': filter_reason
     }
 
+def parse_filter_verdicts(content):
+    """Map section index -> verdict for a batched filter reply; unusable entries are left out."""
+    try:
+        result = loads(content)
+    except ValueError:
+        return {}
+    if not isinstance(result, dict):
+        return {}
+
+    verdicts = {}
+    for r in result.get('results', []):
+        try:
+            # Models sometimes echo ids as strings ("3")
+            if 'needs_consultation' in r:
+                verdicts[int(r['id'])] = r
+        except (TypeError, ValueError, KeyError):
+            continue
+    return verdicts
+
+async def process_filter_batch(section_batch, model):
+    """Phase 1 for several sections in one call; returns results in batch order."""
+    prompt = build_filter_prompt_batch(section_batch)
+
+    fallbacks = [m for m in FILTER_MODEL_FALLBACKS if m != model]
+
+    response = await call_llm_with_retry(
+        model=model,
+        messages=[
+            {"role": "system", "content": "You are a building code expert. Identify sections that need city consultation."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.1,
+        fallback_models=fallbacks,
+        validate=lambda content: parse_filter_verdicts(content).keys() >= set(range(len(section_batch)))
+    )
+
+    # Sections missing from the reply (or an unparseable reply) fall back to their own call below
+    verdicts = parse_filter_verdicts(response.choices[0].message.content)
+
+    results = []
+    for i, section_data in enumerate(section_batch):
+        verdict = verdicts.get(i)
+        if verdict is None:
+            # Model dropped this section; ask about it on its own
+            results.append(await process_filter(section_data, model))
+        else:
+            results.append(build_filter_result(section_data, verdict['needs_consultation'], verdict.get('reason', '')))
+
+    return results
+
 async def process_questions(section_data, model):
     """Phase 2: Generate detailed questions with stronger model."""
     prompt = build_questions_prompt(section_data)
@@ -257,10 +672,11 @@ async def process_questions(section_data, model):
             {"role": "user", "content": prompt}
         ],
         temperature=0.2,
-        fallback_models=fallbacks
+        fallback_models=fallbacks,
+        validate=lambda content: reply_has_keys(content, ['questions', 'severity', 'context'])
     )
 
-    result = json.loads(response.choices[0].message.content)
+    result = loads(response.choices[0].message.content)
 
     return {
         **section_data,  # Keep all phase 1 data
@@ -278,50 +694,87 @@ def format_duration(seconds):
     """Format seconds into human-readable duration."""
     return str(timedelta(seconds=int(seconds)))
 
-def save_progress(results, output_file):
-    """Save progress to file."""
-    temp_file = f"{output_file}.progress"
-    with open(temp_file, 'w') as f:
-        json.dump(results, f, indent=2)
+def clear_progress(output_file):
+    """Remove the progress log once the final output has been written."""
+    Path(f"{output_file}.progress.jsonl").unlink(missing_ok=True)
+
+def save_progress(result, output_file):
+    """Append one result to the JSON Lines progress log (O(1) per save)."""
+    temp_file = f"{output_file}.progress.jsonl"
+    with open(temp_file, 'a', encoding='utf-8') as f:
+        f.write(dumps(result) + "\n")
 
 def load_progress(output_file):
-    """Load progress from file."""
-    temp_file = f"{output_file}.progress"
+    """Load results from an interrupted run's JSON Lines log, keyed by section_key."""
+    temp_file = f"{output_file}.progress.jsonl"
+    done = {}
     try:
-        with open(temp_file, 'r') as f:
-            return json.load(f)
+        with open(temp_file, 'rb') as f:
+            for line in f:
+                try:
+                    result = loads(line)
+                except ValueError:
+                    continue  # Last line may be half-written if the run was killed mid-append
+                done[result['section_key']] = result
     except FileNotFoundError:
-        return []
+        pass
+    return done
 
 # ---------------------------
 # Batch Processing
 # ---------------------------
 
-async def process_batch(sections, model, process_fn, semaphore, progress_dict, phase_name):
-    """Generic batch processor for either phase."""
-    async def process_with_semaphore(section_data):
-        async with semaphore:
-            section_start = time.time()
-            try:
-                result = await process_fn(section_data, model)
-                duration = time.time() - section_start
-
-                progress_dict['completed'] += 1
-                progress_dict['results'].append(result)
-
-                print(f"  [{progress_dict['completed']}/{progress_dict['total']}] {section_data['section_number']} - Completed in {duration:.1f}s")
-
-                # Save progress every 10 sections
-                if progress_dict['completed'] % 10 == 0:
-                    save_progress(progress_dict['results'], progress_dict['output_file'])
+def describe_item(section_data):
+    """Progress label for a single section or a packed list of sections."""
+    if isinstance(section_data, list):
+        return f"{section_data[0]['section_number']}..{section_data[-1]['section_number']} ({len(section_data)} sections)"
+    return section_data['section_number']
 
-                return result
-            except Exception as e:
-                print(f"  ERROR processing {section_data['section_number']}: {e}")
-                return None
+async def process_batch(sections, model, process_fn, concurrency, progress_dict, phase_name):
+    """
+    Generic batch processor for either phase. Items may be sections or lists of sections.
 
-    tasks = [process_with_semaphore(section) for section in sections]
-    return await asyncio.gather(*tasks)
+    A fixed pool of `concurrency` workers pulls from a bounded queue, so only
+    O(concurrency) coroutines exist at once regardless of input size.
+    Returns results in input order (None for items that failed).
+    """
+    results = [None] * len(sections)
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def process_one(section_data):
+        section_start = time.time()
+        try:
+            result = await process_fn(section_data, model)
+            duration = time.time() - section_start
+
+            progress_dict['completed'] += 1
+            for r in (result if isinstance(result, list) else [result]):
+                progress_dict['results'].append(r)
+                save_progress(r, progress_dict['output_file'])
+
+            print(f"  [{progress_dict['completed']}/{progress_dict['total']}] {describe_item(section_data)} - Completed in {duration:.1f}s")
+
+            return result
+        except Exception as e:
+            print(f"  ERROR processing {describe_item(section_data)}: {e}")
+            return None
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            index, section_data = item
+            results[index] = await process_one(section_data)
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    for item in enumerate(sections):
+        await queue.put(item)
+    for _ in workers:
+        await queue.put(None)  # One stop signal per worker
+    await asyncio.gather(*workers)
+
+    return results
 
 # ---------------------------
 # Main Processing Logic
@@ -335,26 +788,66 @@ async def run_phase1(sections, args):
     print(f"Processing {len(sections)} sections")
     print(f"Concurrency: {args.concurrency}\n")
 
+    # Sections repeated across chapters/editions get the same verdict: send one call
+    # per unique (title, text) and fan the verdict out to the duplicates afterwards.
+    # The section number is left out of the key since it differs between copies.
+    groups = defaultdict(list)
+    for section in sections:
+        key = (
+            ' '.join((section['section_title'] or '').split()),
+            ' '.join(section['section_text'].split())
+        )
+        groups[key].append(section)
+    unique_sections = [members[0] for members in groups.values()]
+    if len(unique_sections) < len(sections):
+        print(f"Deduplicated to {len(unique_sections)} unique sections\n")
+
+    # Resume: skip sections answered before an interrupted run stopped
+    done = load_progress(args.phase1_output)
+    pending_sections = [s for s in unique_sections if s['section_key'] not in done]
+    if len(pending_sections) < len(unique_sections):
+        print(f"Resuming: {len(unique_sections) - len(pending_sections)} sections already done\n")
+
+    # Pack several sections per call; the fixed instructions dominate each prompt
+    batch_size = args.phase1_batch_size
+    if batch_size > 1:
+        work_items = [pending_sections[i:i + batch_size] for i in range(0, len(pending_sections), batch_size)]
+        process_fn = process_filter_batch
+    else:
+        work_items = pending_sections
+        process_fn = process_filter
+
     progress_dict = {
         'completed': 0,
-        'total': len(sections),
+        'total': len(work_items),
         'results': [],
         'output_file': args.phase1_output
     }
 
-    semaphore = asyncio.Semaphore(args.concurrency)
     start_time = time.time()
 
-    await process_batch(sections, args.filter_model, process_filter, semaphore, progress_dict, "Phase 1")
+    await process_batch(work_items, args.filter_model, process_fn, args.concurrency, progress_dict, "Phase 1")
+    done.update((r['section_key'], r) for r in progress_dict['results'])
 
     duration = time.time() - start_time
 
-    # Save results
-    with open(args.phase1_output, 'w') as f:
-        json.dump(progress_dict['results'], f, indent=2)
+    results = []
+    for members in groups.values():
+        result = done.get(members[0]['section_key'])
+        if result is None:
+            continue
+        results.append(result)
+        results.extend(
+            build_filter_result(member, result['needs_consultation'], result['filter_reason'])
+            for member in members[1:]
+        )
+
+    # Save results; the progress log is only needed until the final output exists
+    dump_json(results, args.phase1_output)
+    clear_progress(args.phase1_output)
 
     # Count how many need consultation
-    needs_consultation = [r for r in progress_dict['results'] if r and r['needs_consultation']]
+    needs_consultation = [r for r in results if r['needs_consultation']]
 
     print(f"\n{'='*80}")
     print(f"PHASE 1 COMPLETE")
@@ -375,23 +868,29 @@ async def run_phase2(sections, args):
     print(f"Processing {len(sections)} flagged sections")
     print(f"Concurrency: {args.concurrency}\n")
 
+    # Resume: skip sections answered before an interrupted run stopped
+    done = load_progress(args.output)
+    pending_sections = [s for s in sections if s['section_key'] not in done]
+    if len(pending_sections) < len(sections):
+        print(f"Resuming: {len(sections) - len(pending_sections)} sections already done\n")
+
     progress_dict = {
         'completed': 0,
-        'total': len(sections),
+        'total': len(pending_sections),
         'results': [],
         'output_file': args.output
     }
 
-    semaphore = asyncio.Semaphore(args.concurrency)
     start_time = time.time()
 
-    await process_batch(sections, args.question_model, process_questions, semaphore, progress_dict, "Phase 2")
+    await process_batch(pending_sections, args.question_model, process_questions, args.concurrency, progress_dict, "Phase 2")
+    done.update((r['section_key'], r) for r in progress_dict['results'])
 
     duration = time.time() - start_time
 
-    # Save results
-    with open(args.output, 'w') as f:
-        json.dump(progress_dict['results'], f, indent=2)
+    # Save results in input order; the progress log is only needed until the final output exists
+    dump_json([done[s['section_key']] for s in sections if s['section_key'] in done], args.output)
+    clear_progress(args.output)
 
     print(f"\n{'='*80}")
     print(f"PHASE 2 COMPLETE")
@@ -403,11 +902,14 @@ async def run_phase2(sections, args):
 
 async def main_async(args):
     """Main processing logic."""
+    global RATE_LIMITER, PER_ATTEMPT_TIMEOUT
+    if args.rpm or args.tpm:
+        RATE_LIMITER = TokenBucket(args.rpm, args.tpm)
+    PER_ATTEMPT_TIMEOUT = args.per_attempt_timeout
 
     # Load input
     print(f"Loading sections from {args.input}...")
-    with open(args.input, 'r') as f:
-        sections = json.load(f)
+    sections = load_json(args.input)
     print(f"Loaded {len(sections)} sections\n")
 
     if args.phase == 'both' or args.phase == '1':
@@ -435,12 +937,21 @@ def main():
     parser.add_argument('--phase1-output', type=str, help='Phase 1 output file', default='phase1_filtered.json')
     parser.add_argument('--filter-model', type=str, help='Model for phase 1 filtering', default='gpt-4o-mini')
     parser.add_argument('--question-model', type=str, help='Model for phase 2 questions', default='gpt-4o')
+    parser.add_argument('--phase1-batch-size', type=int, default=10, help='Sections packed into each Phase 1 LLM call (1 = one call per section)')
     parser.add_argument('--concurrency', type=int, help='Number of concurrent requests', default=10)
     parser.add_argument('--phase', type=str, choices=['1', '2', 'both'], default='both', help='Which phase to run')
     parser.add_argument('--no-fallback', action='store_true', help='Disable model fallbacks (fail on rate limit)')
+    parser.add_argument('--rpm', type=int, help='Provider requests-per-minute limit (token-bucket throttling)')
+    parser.add_argument('--tpm', type=int, help='Provider tokens-per-minute limit (token-bucket throttling)')
+    parser.add_argument('--per-attempt-timeout', type=float, default=PER_ATTEMPT_TIMEOUT, help='Seconds before a single LLM attempt is abandoned')
+    parser.add_argument('--cache-mode', type=str, choices=CACHE_MODES, default='enabled', help='LLM response cache mode')
+    parser.add_argument('--cache-dir', type=str, default='.llm_cache', help='Directory for cached LLM responses')
 
     args = parser.parse_args()
 
+    LLM_CACHE['mode'] = args.cache_mode
+    LLM_CACHE['dir'] = Path(args.cache_dir)
+
     # If no-fallback is set, clear the fallback lists
     if args.no_fallback:
         FILTER_MODEL_FALLBACKS.clear()
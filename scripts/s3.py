@@ -1,13 +1,48 @@
 """S3 utilities for ICC code scraping."""
 import requests
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import boto3
+from botocore.config import Config
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__name__)
 
 BUCKET_NAME = "set4-codes"
 
 
+@lru_cache(maxsize=None)
+def get_s3_client():
+    """
+    Shared S3 client (boto3 clients are thread-safe once created, but creating
+    one is not, so call this before handing the client to worker threads).
+
+    Reusing one client skips per-call credential resolution and TLS setup, and
+    its connection pool keeps connections alive across uploads. Adaptive retries
+    handle S3 throttling (503 SlowDown) client-side.
+    """
+    return boto3.client(
+        "s3",
+        config=Config(max_pool_connections=64, retries={"mode": "adaptive", "max_attempts": 5}),
+    )
+
+
+@lru_cache(maxsize=None)
+def get_http_session() -> requests.Session:
+    """Shared HTTP session so image downloads reuse keep-alive connections."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=64,
+        pool_maxsize=64,
+        max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504]),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
 class RawICCS3:
     """Handles fetching raw HTML from S3 for ICC codes."""
 
@@ -23,7 +58,7 @@ class RawICCS3:
         self.state = state
         self.version = version
         self.chapter_to_key = chapter_to_key
-        self.s3_client = boto3.client("s3")
+        self.s3_client = get_s3_client()
 
     def chapter(self, chapter_name: str) -> str:
         """
@@ -54,11 +89,10 @@ class RawICCS3:
 def upload_image_to_s3(image_url: str, s3_key: str, s3_bucket: str = "set4-codes") -> str:
     """Download image from URL and upload to S3. Returns S3 URL or empty string."""
     try:
-        response = requests.get(image_url, timeout=30)
+        response = get_http_session().get(image_url, timeout=30)
         response.raise_for_status()
 
-        s3 = boto3.client("s3")
-        s3.put_object(
+        get_s3_client().put_object(
             Bucket=s3_bucket,
             Key=s3_key,
             Body=response.content,
@@ -77,3 +111,20 @@ def upload_image_to_s3(image_url: str, s3_key: str, s3_bucket: str = "set4-codes
     except Exception as e:
         logger.warning(f"Failed to upload image {image_url}: {e}")
         return ""
+
+
+def upload_images_bulk(uploads: list[tuple[str, str]], max_workers: int = 32) -> list[str]:
+    """
+    Upload many (image_url, s3_key) pairs concurrently.
+
+    Returns S3 URLs in input order, with empty strings for failed uploads
+    (same contract as upload_image_to_s3).
+    """
+    if not uploads:
+        return []
+    # Create the shared client and session here: lru_cache doesn't stop several
+    # workers from running the factories at once, and boto3 client creation isn't thread-safe
+    get_s3_client()
+    get_http_session()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda upload: upload_image_to_s3(*upload), uploads))
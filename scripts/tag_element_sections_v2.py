@@ -23,12 +23,16 @@ Usage:
 """
 
 import os
+import re
 import sys
 import json
-import time
+import asyncio
+import httpx
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from typing import Dict, List, Set, Tuple
 from supabase import create_client, Client
+from fast_json import dumps, loads
 
 # ---------------------------
 # Config
@@ -61,6 +65,20 @@ BATCH_SIZE = 150
 # Checkpoint file for resuming
 CHECKPOINT_FILE = 'element_tagging_checkpoint.json'
 
+# Leading chapter digits of a section number (e.g. "1015" in "1015.1")
+CHAPTER_PREFIX_RE = re.compile(r'^(\d+)')
+
+# Skip definition and reserved placeholder sections server-side; the prompt says never to tag
+# them, so sending them to the LLM only costs tokens. NULL titles are kept.
+DEFINITIONAL_TITLE_FILTER = 'title.is.null,and(title.not.ilike.*definition*,title.not.ilike.*reserved*)'
+
+# Gemini batches in flight at once; each call takes tens of seconds, so overlapping them
+# is where the wall-time goes, but stay well under the per-minute request quota
+MAX_CONCURRENT_BATCHES = 4
+
+# Retries for 429 / 5xx responses from Gemini
+MAX_RETRIES = 4
+
 # ---------------------------
 # Checkpoint Management
 # ---------------------------
@@ -114,56 +132,62 @@ def get_element_group_map(supabase: Client) -> Dict[str, str]:
     response = supabase.table('element_groups').select('id, slug').execute()
     return {row['slug']: row['id'] for row in response.data}
 
+def _fetch_chapter(supabase: Client, chapter: str, batch_size: int = 500) -> List[Dict]:
+    """Fetch all CBC sections for one chapter using simple pattern matching (like download_sections.py)"""
+    # Determine pattern based on chapter
+    if chapter == '11B':
+        pattern = '11B-%'  # 11B sections use format: 11B-404.2.1
+    else:
+        pattern = f'{chapter}%'  # Other chapters: 301, 302, 1015.1, etc.
+    
+    offset = 0
+    chapter_sections = []
+    
+    while True:
+        response = supabase.table('sections') \
+            .select('id, key, number, title, text, paragraphs') \
+            .eq('never_relevant', False) \
+            .or_(DEFINITIONAL_TITLE_FILTER) \
+            .like('code_id', '%CBC%') \
+            .like('number', pattern) \
+            .order('id') \
+            .range(offset, offset + batch_size - 1) \
+            .execute()
+        
+        # Stop only on an empty page: a short page can also mean PostgREST's max-rows cap is below batch_size
+        if not response.data:
+            break
+        
+        # Normalize the fetched rows in place rather than copying each into a new dict
+        for r in response.data:
+            r['number'] = r['number'] or ''
+            r['title'] = r['title'] or ''
+            r['text'] = r['text'] or ''
+            # Normalize once here so the prompt builder can slice without re-checking
+            if not isinstance(r['paragraphs'], list):
+                r['paragraphs'] = []
+        chapter_sections.extend(response.data)
+        
+        offset += len(response.data)
+    
+    return chapter_sections
+
 def fetch_cbc_sections(supabase: Client) -> List[Dict]:
     """Fetch all CBC sections from target chapters (all versions)"""
     print(f"📖 Fetching CBC sections (all versions) from chapters: {', '.join(TARGET_CHAPTERS)}")
     
     all_sections = []
-    batch_size = 100
     
-    # Fetch each chapter separately using simple pattern matching (like download_sections.py)
-    for chapter in TARGET_CHAPTERS:
-        print(f"   Fetching Chapter {chapter}...", end=' ', flush=True)
-        
-        # Determine pattern based on chapter
-        if chapter == '11B':
-            pattern = '11B-%'  # 11B sections use format: 11B-404.2.1
-        else:
-            pattern = f'{chapter}%'  # Other chapters: 301, 302, 1015.1, etc.
-        
-        offset = 0
-        chapter_sections = []
-        
-        while True:
-            response = supabase.table('sections') \
-                .select('id, key, number, title, text, paragraphs, code_id') \
-                .eq('never_relevant', False) \
-                .like('code_id', '%CBC%') \
-                .like('number', pattern) \
-                .order('number') \
-                .range(offset, offset + batch_size - 1) \
-                .execute()
-            
-            if not response.data:
-                break
-            
-            chapter_sections.extend([{
-                'id': r['id'],
-                'key': r['key'],
-                'number': r['number'] or '',
-                'title': r['title'] or '',
-                'text': r['text'] or '',
-                'paragraphs': r['paragraphs'] or [],
-                'code_id': r['code_id']
-            } for r in response.data])
-            
-            if len(response.data) < batch_size:
-                break
-            
-            offset += batch_size
-        
-        print(f"✓ {len(chapter_sections)} sections")
-        all_sections.extend(chapter_sections)
+    # Chapters are independent queries, so fetch them concurrently
+    with ThreadPoolExecutor(max_workers=len(TARGET_CHAPTERS)) as executor:
+        futures = {executor.submit(_fetch_chapter, supabase, chapter): chapter for chapter in TARGET_CHAPTERS}
+        for future in as_completed(futures):
+            chapter_sections = future.result()
+            print(f"   Chapter {futures[future]}: ✓ {len(chapter_sections)} sections")
+            all_sections.extend(chapter_sections)
+    
+    # Keep neighbouring sections together so each LLM batch sees related context
+    all_sections.sort(key=lambda s: s['number'])
     
     print(f"✅ Found {len(all_sections)} sections in target chapters")
     
@@ -175,8 +199,7 @@ def fetch_cbc_sections(supabase: Client) -> List[Dict]:
             chapter = '11B'
         else:
             # Extract first digit(s)
-            import re
-            match = re.match(r'^(\d+)', number)
+            match = CHAPTER_PREFIX_RE.match(number)
             chapter = match.group(1) if match else 'other'
         chapter_counts[chapter] = chapter_counts.get(chapter, 0) + 1
     
@@ -190,42 +213,39 @@ def save_mappings(supabase: Client, mappings: List[Tuple[str, str, str]]):
     """
     Save element-section mappings to database
     mappings: List of (section_id, section_key, element_group_id) tuples
+    
+    Each chunk is replaced atomically by the replace_element_mappings RPC
+    (delete existing mappings for its sections, then insert the new ones).
     """
     print(f"\n💾 Saving {len(mappings)} mappings to database...")
     
-    # Clear existing mappings for these sections (we'll rebuild from scratch)
-    section_ids = list(set([m[0] for m in mappings]))
+    # Group by section so one section's mappings never straddle two transactions
+    records_by_section: Dict[str, List[Dict[str, str]]] = {}
+    for section_id, section_key, element_id in mappings:
+        records_by_section.setdefault(section_id, []).append({
+            'section_id': section_id,
+            'section_key': section_key,
+            'element_group_id': element_id
+        })
     
-    if section_ids:
-        # Delete old mappings in batches
-        batch_size = 100
-        for i in range(0, len(section_ids), batch_size):
-            batch = section_ids[i:i+batch_size]
-            supabase.table('element_section_mappings') \
-                .delete() \
-                .in_('section_id', batch) \
-                .execute()
+    chunks = []
+    chunk = []
+    batch_size = 5000
+    for records in records_by_section.values():
+        chunk.extend(records)
+        if len(chunk) >= batch_size:
+            chunks.append(chunk)
+            chunk = []
+    if chunk:
+        chunks.append(chunk)
     
-    # Insert new mappings in batches
     inserted = 0
-    batch_size = 100
-    
-    for i in range(0, len(mappings), batch_size):
-        batch = mappings[i:i+batch_size]
-        records = [
-            {
-                'section_id': section_id,
-                'section_key': section_key,
-                'element_group_id': element_id
-            }
-            for section_id, section_key, element_id in batch
-        ]
-        
+    for records in chunks:
         try:
-            supabase.table('element_section_mappings').insert(records).execute()
-            inserted += len(records)
+            response = supabase.rpc('replace_element_mappings', {'p_mappings': records}).execute()
+            inserted += response.data
         except Exception as e:
-            print(f"⚠️  Error inserting batch: {e}")
+            print(f"⚠️  Error replacing mappings batch: {e}")
     
     print(f"✅ Saved {inserted} mappings")
 
@@ -233,7 +253,52 @@ def save_mappings(supabase: Client, mappings: List[Tuple[str, str, str]]):
 # LLM Classification
 # ---------------------------
 
-def classify_sections_batch(sections: List[Dict]) -> Dict[str, Set[str]]:
+async def post_with_retry(client: httpx.AsyncClient, url: str, body: bytes) -> httpx.Response:
+    """POST to Gemini, retrying rate limits and server errors with exponential backoff"""
+    for attempt in range(MAX_RETRIES):
+        resp = await client.post(url, content=body)
+        if (resp.status_code == 429 or resp.status_code >= 500) and attempt < MAX_RETRIES - 1:
+            delay = 2 ** (attempt + 1)
+            print(f"⚠️  Gemini returned {resp.status_code}, retrying in {delay}s")
+            await asyncio.sleep(delay)
+            continue
+        resp.raise_for_status()
+        return resp
+
+def parse_results(content: str) -> List[Dict]:
+    """
+    Parse the "results" array from Gemini's JSON text
+    
+    If the response was cut off (e.g. at the output token limit), keep every
+    result object that arrived complete instead of dropping the whole batch.
+    """
+    try:
+        return loads(content).get('results', [])
+    except ValueError:
+        pass
+    
+    key_pos = content.find('"results"')
+    start = content.find('[', key_pos) if key_pos != -1 else -1
+    if start == -1:
+        raise ValueError("No results array in LLM response")
+    
+    decoder = json.JSONDecoder()
+    results = []
+    pos = start + 1
+    while True:
+        # Skip separators between array items
+        while pos < len(content) and content[pos] in ' \t\r\n,':
+            pos += 1
+        try:
+            item, pos = decoder.raw_decode(content, pos)
+        except ValueError:
+            break
+        results.append(item)
+    
+    print(f"⚠️  Truncated LLM response, recovered {len(results)} complete results")
+    return results
+
+async def classify_sections_batch(client: httpx.AsyncClient, sections: List[Dict]) -> Dict[str, Set[str]]:
     """
     Use LLM to classify sections as instance-specific element requirements
     
@@ -244,11 +309,8 @@ def classify_sections_batch(sections: List[Dict]) -> Dict[str, Set[str]]:
         print("⚠️  GEMINI_API_KEY not set, skipping LLM classification")
         return {}
     
-    import requests
-    
     # Gemini 2.5 Pro API
     url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-pro:generateContent?key={api_key}"
-    headers = {"Content-Type": "application/json"}
     
     system_prompt = """You are a building code expert. Your task is to identify which building code sections contain requirements that must be checked PER INDIVIDUAL INSTANCE of specific building elements.
 
@@ -276,7 +338,7 @@ DO NOT tag if:
 - The section delegates to another section without specific requirements
 
 Return a JSON object with a "results" array. Each result has:
-- "section_number": the section number
+- "idx": the idx of the section, copied from the input
 - "elements": array of element type strings (empty array if none apply)
 - "reasoning": brief explanation (optional, for debugging)
 
@@ -284,12 +346,12 @@ Example response:
 {
   "results": [
     {
-      "section_number": "11B-404.2.3",
+      "idx": 0,
       "elements": ["doors"],
       "reasoning": "Specifies clear width requirement for each door"
     },
     {
-      "section_number": "11B-216.2",
+      "idx": 1,
       "elements": [],
       "reasoning": "Scoping - about how many doors need to be accessible, not individual door specs"
     }
@@ -299,20 +361,19 @@ Example response:
     
     # Build payload
     sections_payload = []
-    for section in sections:
-        paragraphs_text = []
-        if section.get('paragraphs') and isinstance(section['paragraphs'], list):
-            paragraphs_text = section['paragraphs']
-        
-        sections_payload.append({
+    for i, section in enumerate(sections):
+        entry = {
             "section_number": section['number'],
             "title": section['title'],
             "text": section['text'],
-            "paragraphs": paragraphs_text[:3],  # Limit to first 3 paragraphs for token efficiency
-        })
+            # text is built from the title plus every paragraph, so only fall back to paragraphs without it
+            "paragraphs": [] if section['text'] else section['paragraphs'][:3],  # Limit to first 3 paragraphs for token efficiency
+        }
+        # Empty strings/lists carry no signal but still cost tokens
+        sections_payload.append({"idx": i, **{k: v for k, v in entry.items() if v}})
     
     # Gemini API format
-    user_content = json.dumps({"sections": sections_payload}, ensure_ascii=False)
+    user_content = dumps({"sections": sections_payload})
     
     data = {
         "contents": [{
@@ -327,28 +388,28 @@ Example response:
     }
     
     try:
-        resp = requests.post(url, headers=headers, json=data, timeout=240)
-        resp.raise_for_status()
-        result = resp.json()
+        resp = await post_with_retry(client, url, dumps(data).encode())
+        result = loads(resp.content)
         
         # Extract content from Gemini response
         content = result['candidates'][0]['content']['parts'][0]['text']
-        parsed = json.loads(content)
+        results_list = parse_results(content)
         
         # Build result map: section_id -> set of element types
         result_map = {}
-        results_list = parsed.get('results', [])
-        
-        # Create lookup by section number
-        section_by_number = {s['number']: s for s in sections}
         
         for item in results_list:
-            section_num = item.get('section_number', '')
-            elements = item.get('elements', [])
+            # idx is the section's position in this batch, so map it straight back to its id.
+            # Plain JSON mode has no schema, so models sometimes echo it as a string ("3").
+            try:
+                if isinstance(item['idx'], bool):
+                    continue
+                idx = int(item['idx'])
+            except (TypeError, ValueError, KeyError):
+                continue
             
-            if section_num in section_by_number:
-                section_id = section_by_number[section_num]['id']
-                result_map[section_id] = set(elements)
+            if 0 <= idx < len(sections):
+                result_map[sections[idx]['id']] = set(item.get('elements', []))
         
         return result_map
     
@@ -356,6 +417,30 @@ Example response:
         print(f"⚠️  LLM API error: {e}")
         return {}
 
+async def classify_all(sections_to_process: List[Dict], all_classifications: Dict[str, Set[str]], total_sections: int):
+    """Classify sections in concurrent Gemini batches, checkpointing as each batch lands"""
+    batches = [sections_to_process[i:i+BATCH_SIZE] for i in range(0, len(sections_to_process), BATCH_SIZE)]
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_BATCHES)
+    completed = 0
+    
+    async with httpx.AsyncClient(timeout=240, headers={"Content-Type": "application/json"}) as client:
+        async def run_batch(batch_num: int, batch: List[Dict]):
+            nonlocal completed
+            async with semaphore:
+                classifications = await classify_sections_batch(client, batch)
+            
+            all_classifications.update(classifications)
+            completed += 1
+            
+            # Count how many sections got tagged in this batch
+            tagged_count = sum(1 for tags in classifications.values() if tags)
+            print(f"Batch {batch_num}/{len(batches)} ({len(batch)} sections) ✓ ({tagged_count} tagged) [{completed}/{len(batches)} done]")
+            
+            # Save checkpoint after each batch
+            save_checkpoint(all_classifications, total_sections)
+        
+        await asyncio.gather(*(run_batch(i + 1, batch) for i, batch in enumerate(batches)))
+
 # ---------------------------
 # Main
 # ---------------------------
@@ -397,30 +482,11 @@ def main():
     
     # Process in batches
     if sections_to_process:
-        print(f"\n🤖 Classifying sections using LLM (batch size: {BATCH_SIZE})...")
+        print(f"\n🤖 Classifying sections using LLM (batch size: {BATCH_SIZE}, {MAX_CONCURRENT_BATCHES} in flight)...")
         print(f"   This will make approximately {(len(sections_to_process) + BATCH_SIZE - 1) // BATCH_SIZE} API calls")
         print()
-    
-    for i in range(0, len(sections_to_process), BATCH_SIZE):
-        batch = sections_to_process[i:i+BATCH_SIZE]
-        batch_num = i // BATCH_SIZE + 1
-        total_batches = (len(sections_to_process) + BATCH_SIZE - 1) // BATCH_SIZE
-        
-        print(f"Processing batch {batch_num}/{total_batches} ({len(batch)} sections)...", end=' ', flush=True)
-        
-        classifications = classify_sections_batch(batch)
-        all_classifications.update(classifications)
-        
-        # Count how many sections got tagged in this batch
-        tagged_count = sum(1 for tags in classifications.values() if tags)
-        print(f"✓ ({tagged_count} tagged)")
-        
-        # Save checkpoint after each batch
-        save_checkpoint(all_classifications, len(sections))
         
-        # Rate limiting
-        if i + BATCH_SIZE < len(sections_to_process):
-            time.sleep(1)
+        asyncio.run(classify_all(sections_to_process, all_classifications, len(sections)))
     
     # Save final results to separate file (for reference/backup)
     results_file = 'element_tagging_results.json'
@@ -0,0 +1,279 @@
+"""
+Unit tests for process_sections_with_llm.py rate limiting and retry helpers.
+"""
+
+import sys
+import os
+import asyncio
+import pytest
+
+# Add parent directory to path to import the processing module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Use litellm's bundled model cost map instead of fetching it on import
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+pytest.importorskip("litellm")
+
+import process_sections_with_llm as llm
+from process_sections_with_llm import CircuitBreaker, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake monotonic clock; asyncio.sleep advances it instead of waiting. Returns the list of sleeps."""
+    now = [1000.0]
+    sleeps = []
+
+    async def fake_sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    monkeypatch.setattr(llm.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(llm.asyncio, "sleep", fake_sleep)
+    return sleeps
+
+
+class TestTokenBucket:
+    """Test the TokenBucket rate limiter."""
+
+    def test_starts_full(self, clock):
+        """A fresh bucket allows a full minute's worth of requests without waiting."""
+        bucket = TokenBucket(requests_per_minute=3)
+
+        async def run():
+            for _ in range(3):
+                await bucket.acquire(10)
+
+        asyncio.run(run())
+        assert clock == []
+
+    def test_request_limit_waits_for_refill(self, clock):
+        """Once requests run out, acquire waits for one request's worth of refill."""
+        bucket = TokenBucket(requests_per_minute=2)
+
+        async def run():
+            for _ in range(3):
+                await bucket.acquire(10)
+
+        asyncio.run(run())
+        assert clock == [pytest.approx(30.0)]
+
+    def test_token_limit_waits_for_refill(self, clock):
+        """A request that doesn't fit in the remaining tokens waits for the shortfall."""
+        bucket = TokenBucket(tokens_per_minute=1000)
+
+        async def run():
+            await bucket.acquire(600)
+            await bucket.acquire(600)
+
+        asyncio.run(run())
+        assert clock == [pytest.approx(12.0)]
+
+    def test_oversized_request_is_capped(self, clock):
+        """A request larger than the whole bucket proceeds instead of waiting forever."""
+        bucket = TokenBucket(tokens_per_minute=100)
+        asyncio.run(bucket.acquire(5000))
+        assert clock == []
+
+    def test_unbounded_without_limits(self, clock):
+        """No limits means acquire never waits."""
+        bucket = TokenBucket()
+
+        async def run():
+            for _ in range(100):
+                await bucket.acquire(10_000)
+
+        asyncio.run(run())
+        assert clock == []
+
+
+class TestCircuitBreaker:
+    """Test CircuitBreaker state transitions."""
+
+    def open_breaker(self, breaker, model="m"):
+        """Record enough consecutive failures to trip the breaker."""
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure(model)
+
+    def elapse(self, seconds):
+        """Advance the fake clock (the clock fixture's sleep moves time forward)."""
+        asyncio.run(llm.asyncio.sleep(seconds))
+
+    def test_stays_closed_below_threshold(self, clock):
+        """Failures under the threshold keep the breaker closed."""
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30.0)
+        breaker.record_failure("m")
+        breaker.record_failure("m")
+        assert breaker.allow("m")
+
+    def test_success_resets_failure_count(self, clock):
+        """Failures only count while consecutive."""
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30.0)
+        breaker.record_failure("m")
+        breaker.record_success("m")
+        breaker.record_failure("m")
+        assert breaker.allow("m")
+
+    def test_opens_at_threshold(self, clock):
+        """Reaching the threshold opens the breaker for reset_timeout."""
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30.0)
+        self.open_breaker(breaker)
+        assert not breaker.allow("m")
+        assert breaker.cooldown_remaining("m") == pytest.approx(30.0)
+        assert breaker.allow("other")
+
+    def test_half_open_allows_single_probe(self, clock):
+        """After the cooldown exactly one probe is let through."""
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30.0)
+        self.open_breaker(breaker)
+        self.elapse(30.0)
+        assert breaker.cooldown_remaining("m") == 0.0
+        assert breaker.allow("m")
+        assert not breaker.allow("m")
+
+    def test_probe_success_closes(self, clock):
+        """A successful probe closes the breaker."""
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30.0)
+        self.open_breaker(breaker)
+        self.elapse(30.0)
+        assert breaker.allow("m")
+        breaker.record_success("m")
+        assert breaker.allow("m")
+        assert breaker.allow("m")
+
+    def test_probe_failure_reopens(self, clock):
+        """A failed probe restarts the cooldown."""
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30.0)
+        self.open_breaker(breaker)
+        self.elapse(30.0)
+        assert breaker.allow("m")
+        breaker.record_failure("m")
+        assert not breaker.allow("m")
+        assert breaker.cooldown_remaining("m") == pytest.approx(30.0)
+
+    def test_release_probe_frees_half_open_slot(self, clock):
+        """A released probe lets the next caller probe again."""
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30.0)
+        self.open_breaker(breaker)
+        self.elapse(30.0)
+        assert breaker.allow("m")
+        breaker.release_probe("m")
+        assert breaker.allow("m")
+
+    def test_non_retryable_probe_error_releases_probe(self, clock, monkeypatch):
+        """A probe that raises a non-retryable error must not leave the model stuck half-open."""
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30.0)
+        monkeypatch.setattr(llm, "CIRCUIT_BREAKER", breaker)
+        monkeypatch.setitem(llm.LLM_CACHE, "mode", "disabled")
+
+        async def bad_request(**kwargs):
+            raise ValueError("bad request")
+
+        monkeypatch.setattr(llm, "acompletion", bad_request)
+        self.open_breaker(breaker)
+        self.elapse(30.0)
+
+        messages = [{"role": "user", "content": "hi"}]
+        with pytest.raises(ValueError):
+            asyncio.run(llm.call_llm_with_retry("m", messages, 0.0))
+        assert breaker.allow("m")
+
+
+class TestResponseCache:
+    """Test that only validated replies are cached."""
+
+    @pytest.fixture
+    def cache(self, tmp_path, monkeypatch):
+        """Enabled cache in a temp directory with a fresh breaker."""
+        monkeypatch.setitem(llm.LLM_CACHE, "mode", "enabled")
+        monkeypatch.setitem(llm.LLM_CACHE, "dir", tmp_path)
+        monkeypatch.setattr(llm, "CIRCUIT_BREAKER", CircuitBreaker())
+        return tmp_path
+
+    def reply(self, monkeypatch, content):
+        """Make acompletion return content, counting calls."""
+        calls = []
+
+        async def fake_completion(**kwargs):
+            calls.append(kwargs["model"])
+            return llm.SimpleNamespace(choices=[llm.SimpleNamespace(message=llm.SimpleNamespace(content=content))])
+
+        monkeypatch.setattr(llm, "acompletion", fake_completion)
+        return calls
+
+    def call(self, validate):
+        """Run call_llm_with_retry and return the reply text."""
+        messages = [{"role": "user", "content": "hi"}]
+        response = asyncio.run(llm.call_llm_with_retry("m", messages, 0.0, validate=validate))
+        return response.choices[0].message.content
+
+    def test_invalid_reply_is_not_cached(self, cache, monkeypatch):
+        """A reply that fails validation is returned but not stored."""
+        validate = lambda content: llm.reply_has_keys(content, ["needs_consultation"])
+        calls = self.reply(monkeypatch, '{"reason": "truncated')
+        assert self.call(validate) == '{"reason": "truncated'
+        assert list(cache.iterdir()) == []
+
+        calls = self.reply(monkeypatch, '{"needs_consultation": false}')
+        assert self.call(validate) == '{"needs_consultation": false}'
+        assert calls == ["m"]
+        assert [p.suffix for p in cache.iterdir()] == [".json"]
+
+    def test_valid_reply_is_replayed(self, cache, monkeypatch):
+        """A validated reply is served from the cache on the next call."""
+        validate = lambda content: llm.reply_has_keys(content, ["needs_consultation"])
+        self.reply(monkeypatch, '{"needs_consultation": true}')
+        self.call(validate)
+        calls = self.reply(monkeypatch, '{"needs_consultation": false}')
+        assert self.call(validate) == '{"needs_consultation": true}'
+        assert calls == []
+
+    def test_invalid_cached_entry_is_a_miss(self, cache, monkeypatch):
+        """An entry that fails validation (e.g. cached before validation existed) is refetched."""
+        self.reply(monkeypatch, "not json")
+        self.call(None)
+        calls = self.reply(monkeypatch, '{"needs_consultation": true}')
+        assert self.call(lambda content: llm.reply_has_keys(content, ["needs_consultation"])) == '{"needs_consultation": true}'
+        assert calls == ["m"]
+
+
+class TestParseFilterVerdicts:
+    """Test the parse_filter_verdicts function."""
+
+    def test_coerces_string_ids(self):
+        """Ids echoed back as strings still map to their section."""
+        content = '{"results": [{"id": "0", "needs_consultation": true}, {"id": 1, "needs_consultation": false}]}'
+        assert set(llm.parse_filter_verdicts(content)) == {0, 1}
+
+    def test_skips_unusable_entries(self):
+        """Entries without a numeric id or a verdict are left out."""
+        content = '{"results": [{"id": "x", "needs_consultation": true}, {"id": 1}, "junk", {"needs_consultation": true}]}'
+        assert llm.parse_filter_verdicts(content) == {}
+
+    def test_unparseable_reply(self):
+        """Invalid JSON or a non-object reply yields no verdicts."""
+        assert llm.parse_filter_verdicts('{"results": [') == {}
+        assert llm.parse_filter_verdicts('[]') == {}
+
+
+class TestRetryBackoff:
+    """Test retry delays in call_llm_with_retry."""
+
+    def test_retry_after_is_capped(self, clock, monkeypatch):
+        """A huge Retry-After header is clamped to the backoff ceiling."""
+        monkeypatch.setattr(llm, "CIRCUIT_BREAKER", CircuitBreaker())
+        monkeypatch.setitem(llm.LLM_CACHE, "mode", "disabled")
+        attempts = []
+
+        async def rate_limited_once(**kwargs):
+            attempts.append(kwargs["model"])
+            if len(attempts) == 1:
+                response = llm.SimpleNamespace(headers={"retry-after": "86400"})
+                error = llm.RateLimitError(message="slow down", llm_provider="openai", model="m")
+                error.response = response
+                raise error
+            return llm.SimpleNamespace(choices=[llm.SimpleNamespace(message=llm.SimpleNamespace(content="{}"))])
+
+        monkeypatch.setattr(llm, "acompletion", rate_limited_once)
+        asyncio.run(llm.call_llm_with_retry("m", [{"role": "user", "content": "hi"}], 0.0))
+        assert clock == [llm.MAX_BACKOFF_SECONDS]
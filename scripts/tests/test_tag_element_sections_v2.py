@@ -0,0 +1,87 @@
+"""
+Unit tests for tag_element_sections_v2.py response parsing.
+"""
+
+import sys
+import os
+import asyncio
+import json
+import pytest
+
+# Add parent directory to path to import the tagger module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("supabase")
+
+from tag_element_sections_v2 import classify_sections_batch, parse_results
+
+
+class TestParseResults:
+    """Test the parse_results function."""
+
+    def test_complete_array(self):
+        """A well-formed response returns every result."""
+        content = '{"results": [{"idx": 0, "elements": ["doors"]}, {"idx": 1, "elements": []}]}'
+        assert parse_results(content) == [
+            {"idx": 0, "elements": ["doors"]},
+            {"idx": 1, "elements": []},
+        ]
+
+    def test_missing_results_key(self):
+        """A valid object without results yields no results."""
+        assert parse_results('{}') == []
+
+    def test_truncated_mid_object(self):
+        """A response cut off mid-object keeps the results that arrived complete."""
+        content = '{"results": [{"idx": 0, "elements": ["doors"]},\n  {"idx": 1, "elements": ["ra'
+        assert parse_results(content) == [{"idx": 0, "elements": ["doors"]}]
+
+    def test_truncated_after_complete_object(self):
+        """A response cut off between objects keeps all of them."""
+        content = '{"results": [{"idx": 0, "elements": []},\n  {"idx": 1, "elements": ["ramps"]}\n'
+        assert parse_results(content) == [
+            {"idx": 0, "elements": []},
+            {"idx": 1, "elements": ["ramps"]},
+        ]
+
+    def test_truncated_before_first_object(self):
+        """A response cut off before any result finished yields no results."""
+        assert parse_results('{"results": [{"idx": 0, "elem') == []
+
+    def test_garbage_input(self):
+        """Text with no results array raises ValueError."""
+        with pytest.raises(ValueError):
+            parse_results("Sorry, I can't help with that.")
+
+
+class TestClassifySectionsBatch:
+    """Test mapping Gemini results back to section ids."""
+
+    def classify(self, monkeypatch, sections, results):
+        """Run classify_sections_batch against a fake Gemini returning results."""
+        monkeypatch.setenv("GEMINI_API_KEY", "test")
+        body = {"candidates": [{"content": {"parts": [{"text": json.dumps({"results": results})}]}}]}
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, json=body))
+
+        async def run():
+            async with httpx.AsyncClient(transport=transport) as client:
+                return await classify_sections_batch(client, sections)
+
+        return asyncio.run(run())
+
+    def test_idx_coercion(self, monkeypatch):
+        """String idx values map like ints; bools, junk and out-of-range values are ignored."""
+        sections = [
+            {"id": name, "number": "11B-404.2", "title": "Doors", "text": "Width", "paragraphs": []}
+            for name in ["a", "b", "c", "d"]
+        ]
+        results = [
+            {"idx": "0", "elements": ["doors"]},
+            {"idx": True, "elements": ["walls"]},
+            {"idx": "one", "elements": ["ramps"]},
+            {"idx": 9, "elements": ["stairs"]},
+            {"elements": ["signage"]},
+            {"idx": 3, "elements": []},
+        ]
+        assert self.classify(monkeypatch, sections, results) == {"a": {"doors"}, "d": set()}
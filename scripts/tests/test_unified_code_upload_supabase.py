@@ -0,0 +1,58 @@
+"""
+Unit tests for load_db/unified_code_upload_supabase.py helpers.
+"""
+
+import sys
+import os
+import pytest
+
+# Add load_db directory to path to import the uploader module
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'load_db'))
+
+pytest.importorskip("supabase")
+
+from unified_code_upload_supabase import group_by_depth
+
+
+def keys(waves):
+    """Reduce waves to their item keys for easy comparison."""
+    return [[item["key"] for item in wave] for wave in waves]
+
+
+class TestGroupByDepth:
+    """Test the group_by_depth function."""
+
+    def test_children_listed_before_parents(self):
+        """Every parent lands in an earlier wave than its children, whatever the input order."""
+        items = [
+            {"key": "11B-404.2.1", "parent_key": "11B-404.2"},
+            {"key": "11B-404.2", "parent_key": "11B-404"},
+            {"key": "11B-404", "parent_key": None},
+        ]
+        assert keys(group_by_depth(items)) == [["11B-404"], ["11B-404.2"], ["11B-404.2.1"]]
+
+    def test_siblings_share_a_wave_in_input_order(self):
+        """Items at the same depth are upserted together, in their original order."""
+        items = [
+            {"key": "1004", "parent_key": None},
+            {"key": "1004.2", "parent_key": "1004"},
+            {"key": "1005", "parent_key": None},
+            {"key": "1004.1", "parent_key": "1004"},
+        ]
+        assert keys(group_by_depth(items)) == [["1004", "1005"], ["1004.2", "1004.1"]]
+
+    def test_parent_outside_upload_is_root(self):
+        """A parent_key that isn't part of this upload already exists, so the item goes first."""
+        items = [
+            {"key": "11B-216.5", "parent_key": "11B-216"},
+            {"key": "11B-216.5.1", "parent_key": "11B-216.5"},
+        ]
+        assert keys(group_by_depth(items)) == [["11B-216.5"], ["11B-216.5.1"]]
+
+    def test_missing_parent_key_field(self):
+        """Items without a parent_key field are treated as roots."""
+        assert keys(group_by_depth([{"key": "301"}])) == [["301"]]
+
+    def test_empty(self):
+        """No items means no waves."""
+        assert group_by_depth([]) == []
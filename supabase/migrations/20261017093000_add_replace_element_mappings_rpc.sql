@@ -0,0 +1,33 @@
+-- Replace the element-section mappings for a set of sections in one transaction
+-- Used by scripts/load_tagging_results.py: the previous client-side DELETE + INSERT
+-- batches could leave sections with no mappings if the script died in between
+
+CREATE OR REPLACE FUNCTION public.replace_element_mappings(
+  p_mappings jsonb
+)
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_section_ids uuid[];
+  v_inserted integer := 0;
+BEGIN
+  SELECT ARRAY(
+    SELECT DISTINCT (m->>'section_id')::uuid
+    FROM jsonb_array_elements(p_mappings) m
+  ) INTO v_section_ids;
+
+  DELETE FROM element_section_mappings
+  WHERE section_id = ANY(v_section_ids);
+
+  INSERT INTO element_section_mappings (section_id, section_key, element_group_id)
+  SELECT p.section_id, p.section_key, p.element_group_id
+  FROM jsonb_to_recordset(p_mappings) AS p(section_id uuid, section_key text, element_group_id uuid);
+
+  GET DIAGNOSTICS v_inserted = ROW_COUNT;
+
+  RETURN v_inserted;
+END;
+$$;
+
+COMMENT ON FUNCTION public.replace_element_mappings(jsonb) IS 'Atomically replaces element_section_mappings for every section_id in the payload (array of {section_id, section_key, element_group_id})';